@@ -0,0 +1,454 @@
+import os
+import numpy as np
+
+
+class CellPopulation:
+    """
+    Array-backed (struct-of-arrays) population of cells.
+
+    Each cell attribute is stored in its own contiguous array; only the first `n` entries
+    are live. The arrays double in size when full so that adding cells is amortised O(1).
+    """
+
+    def __init__(self, phenotype, capacity=None):
+        phenotype = np.asarray(phenotype, dtype=float)
+        n = len(phenotype)
+        capacity = max(capacity or 0, 2*n, 16)
+
+        self.n = n
+        self.next_id = n  # cells get sequential integer ids
+        self.phenotype = np.empty(capacity)
+        self.age = np.zeros(capacity)
+        self.divisions = np.zeros(capacity, dtype=np.int32)
+        self.cell_id = np.empty(capacity, dtype=np.int64)
+        self.parent_id = np.full(capacity, -1, dtype=np.int64)  # -1 for the initial cells
+
+        self.phenotype[:n] = phenotype
+        self.cell_id[:n] = np.arange(n)
+
+        # set by LineageRecorder to be told about every division
+        self.lineage = None
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def capacity(self):
+        return len(self.phenotype)
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity = 2*capacity
+        for name in ("phenotype", "age", "divisions", "cell_id", "parent_id"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def phenotypes(self):
+        # view of the live phenotypes (copy it if it needs to outlive the next event)
+        return self.phenotype[:self.n]
+
+    def update_phenotype(self, dt, rng, mu=0.12, sigma=0.05):
+        """
+        Update the phenotype of every cell via Euler-Maruyama method for SDE:
+        dX = mu*dt + sigma*dW
+        """
+        n = self.n
+        dW = rng.normal(0, np.sqrt(dt), size=n)
+        self.phenotype[:n] += mu*dt + sigma*dW
+        self.age[:n] += dt
+
+    def divide(self, i):
+        """
+        Symmetric division of cell i: GSC -> GSC + GSC.
+        The first daughter takes the parent's slot and the second is appended.
+        Returns the indices of the two daughters.
+        """
+        if self.n + 1 > self.capacity:
+            self._grow(self.n + 1)
+        j = self.n
+        parent = self.cell_id[i]
+
+        self.phenotype[j] = self.phenotype[i]
+        self.divisions[j] = self.divisions[i] + 1
+        for k in (i, j):
+            self.age[k] = 0
+            self.parent_id[k] = parent
+            self.cell_id[k] = self.next_id
+            self.next_id += 1
+        self.divisions[i] += 1
+        self.n += 1
+        if self.lineage is not None:
+            self.lineage.add_division(parent, self.cell_id[i])
+        return i, j
+
+
+class Recorder:
+    """
+    Base class for the things gillespie_ibm records.
+
+    start is called with the initial population, advance with the time of the next event
+    before it is applied (the population is unchanged on [previous event, t)), after_event once
+    the event has been applied and finish with the final time. close is always called at the
+    end, also when the simulation raises, to release files and other resources.
+    """
+
+    def start(self, t, cells):
+        pass
+
+    def advance(self, t, cells):
+        pass
+
+    def after_event(self, t, cells):
+        pass
+
+    def finish(self, t, cells):
+        pass
+
+    def close(self):
+        pass
+
+
+class PhenotypeHistoryRecorder(Recorder):
+    """Full copy of the phenotypes after every event (memory grows as events x cells)."""
+
+    def __init__(self):
+        self.pheno_list = []
+
+    def start(self, t, cells):
+        self.pheno_list.append(cells.phenotypes().copy())
+
+    def after_event(self, t, cells):
+        self.pheno_list.append(cells.phenotypes().copy())
+
+
+class _TimeGridRecorder(Recorder):
+    # calls _record for every point of t_grid, with the population as it was at that time
+
+    def __init__(self, t_grid):
+        self.t_grid = np.asarray(t_grid, dtype=float)
+        self._k = 0
+
+    def _record_until(self, t, cells, inclusive):
+        k_end = np.searchsorted(self.t_grid, t, side="right" if inclusive else "left")
+        if k_end > self._k:
+            self._record(self._k, k_end, cells)
+            self._k = k_end
+
+    def advance(self, t, cells):
+        self._record_until(t, cells, inclusive=False)
+
+    def finish(self, t, cells):
+        self._record_until(t, cells, inclusive=True)
+
+
+class HistogramRecorder(_TimeGridRecorder):
+    """Histogram of the phenotypes and number of cells at each time in t_grid."""
+
+    def __init__(self, t_grid, bins):
+        super().__init__(t_grid)
+        self.bins = np.asarray(bins, dtype=float)
+        self.counts = np.zeros((len(self.t_grid), len(self.bins) - 1), dtype=np.int64)
+        self.N = np.zeros(len(self.t_grid), dtype=np.int64)
+
+    def _record(self, k_start, k_end, cells):
+        self.counts[k_start:k_end] = np.histogram(cells.phenotypes(), bins=self.bins)[0]
+        self.N[k_start:k_end] = len(cells)
+
+
+class SummaryRecorder(Recorder):
+    """Number of cells and phenotype mean, standard deviation, min and max after every event."""
+
+    fields = ("t", "N", "mean", "std", "min", "max")
+
+    def __init__(self):
+        self._rows = []
+
+    def _append(self, t, cells):
+        x = cells.phenotypes()
+        self._rows.append((t, len(x), x.mean(), x.std(), x.min(), x.max()))
+
+    def start(self, t, cells):
+        self._append(t, cells)
+
+    def after_event(self, t, cells):
+        self._append(t, cells)
+
+    def as_dict(self):
+        values = np.array(self._rows, dtype=float).reshape(-1, len(self.fields))
+        return {name: values[:, i] for i, name in enumerate(self.fields)}
+
+
+class SnapshotRecorder(_TimeGridRecorder):
+    """
+    Full phenotype snapshots at each time in t_grid, appended to an on-disk store so that only
+    one snapshot is held in memory. The store is a directory with the concatenated phenotypes
+    (phenotype.f8) and the snapshot times and offsets (times.npy, offsets.npy), written when
+    the recorder is closed, so an interrupted simulation leaves a readable store of the
+    snapshots taken so far. Read it back with SnapshotStore.
+    """
+
+    def __init__(self, path, t_grid):
+        super().__init__(t_grid)
+        self.path = path
+        self._file = None
+        self._offsets = [0]
+
+    def start(self, t, cells):
+        os.makedirs(self.path, exist_ok=True)
+        self._file = open(os.path.join(self.path, "phenotype.f8"), "wb")
+        self._offsets = [0]
+
+    def _record(self, k_start, k_end, cells):
+        x = np.ascontiguousarray(cells.phenotypes(), dtype="<f8")
+        for _ in range(k_start, k_end):
+            x.tofile(self._file)
+            self._offsets.append(self._offsets[-1] + len(x))
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        n = len(self._offsets) - 1
+        np.save(os.path.join(self.path, "times.npy"), self.t_grid[:n])
+        np.save(os.path.join(self.path, "offsets.npy"), np.array(self._offsets, dtype=np.int64))
+
+
+class SnapshotStore:
+    """Lazy, memory-mapped access to the snapshots written by SnapshotRecorder."""
+
+    def __init__(self, path):
+        self.times = np.load(os.path.join(path, "times.npy"))
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        if self.offsets[-1] > 0:
+            self._data = np.memmap(os.path.join(path, "phenotype.f8"), dtype="<f8", mode="r")
+        else:
+            self._data = np.zeros(0)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, k):
+        return self._data[self.offsets[k]:self.offsets[k + 1]]
+
+
+class LineageRecorder(Recorder):
+    """
+    Exact lineage tree of every cell ever born, stored as compact arrays indexed by cell id.
+
+    Cell ids are sequential: the initial cells are 0..n_roots-1 and the two daughters of a
+    division get consecutive ids, so sisters and children are found arithmetically. For each id
+    the recorder keeps the parent id (-1 for initial cells), birth time, depth in the tree,
+    the initial cell (clone) it descends from and the id of its first daughter (-1 if it has
+    not divided). All queries take arrays of ids and are vectorised; the id -1 (the parent of an
+    initial cell, or a missing child or sister) gives -1 (nan for birth times) and ids that were
+    never assigned raise IndexError.
+    """
+
+    def __init__(self, capacity=1024):
+        self.n_ids = 0
+        self.n_roots = 0
+        self.parent = np.empty(capacity, dtype=np.int64)
+        self.birth_time = np.empty(capacity)
+        self.depth = np.empty(capacity, dtype=np.int32)
+        self.clone = np.empty(capacity, dtype=np.int32)
+        self.first_child = np.empty(capacity, dtype=np.int64)
+        self.alive_ids = None
+        self._t = 0.0
+
+    def _grow(self, needed):
+        capacity = len(self.parent)
+        while capacity < needed:
+            capacity = 2*capacity
+        for name in ("parent", "birth_time", "depth", "clone", "first_child"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.n_ids] = old[:self.n_ids]
+            setattr(self, name, new)
+
+    def start(self, t, cells):
+        n = len(cells)
+        if n > len(self.parent):
+            self._grow(n)
+        self.parent[:n] = -1
+        self.birth_time[:n] = t
+        self.depth[:n] = 0
+        self.clone[:n] = np.arange(n)
+        self.first_child[:n] = -1
+        self.n_ids = self.n_roots = n
+        self._t = t
+        cells.lineage = self
+
+    def advance(self, t, cells):
+        # time of the event about to be applied, used as the birth time of any daughters
+        self._t = t
+
+    def add_division(self, parent, first_daughter):
+        if first_daughter != self.n_ids:
+            raise RuntimeError(f"Expected daughter id {self.n_ids}, received {first_daughter}")
+        if self.n_ids + 2 > len(self.parent):
+            self._grow(self.n_ids + 2)
+        k = slice(self.n_ids, self.n_ids + 2)
+        self.parent[k] = parent
+        self.birth_time[k] = self._t
+        self.depth[k] = self.depth[parent] + 1
+        self.clone[k] = self.clone[parent]
+        self.first_child[k] = -1
+        self.first_child[parent] = first_daughter
+        self.n_ids += 2
+
+    def finish(self, t, cells):
+        self.alive_ids = cells.cell_id[:len(cells)].copy()
+        cells.lineage = None
+
+    def _ids(self, ids):
+        if ids is None:
+            return np.arange(self.n_ids)
+        ids = np.asarray(ids, dtype=np.int64)
+        if np.any(ids >= self.n_ids):
+            raise IndexError(f"Cell ids must be below {self.n_ids}, received {ids.max()}")
+        return ids
+
+    def _lookup(self, values, ids, fill):
+        # negative ids (e.g. the parent -1 of an initial cell) give fill
+        ids = self._ids(ids)
+        return np.where(ids >= 0, values[np.maximum(ids, 0)], fill)
+
+    def parents(self, ids=None):
+        return self._lookup(self.parent, ids, -1)
+
+    def depths(self, ids=None):
+        return self._lookup(self.depth, ids, -1)
+
+    def birth_times(self, ids=None):
+        return self._lookup(self.birth_time, ids, np.nan)
+
+    def clones(self, ids=None):
+        """Initial cell each id descends from."""
+        return self._lookup(self.clone, ids, -1)
+
+    def sisters(self, ids):
+        """Sister of each id (-1 for the initial cells)."""
+        ids = self._ids(ids)
+        offset = ids - self.n_roots
+        return np.where(offset >= 0, ids + 1 - 2*(offset % 2), -1)
+
+    def children(self, ids):
+        """Both daughters of each id as an (n, 2) array (-1 if the cell has not divided)."""
+        first = self._lookup(self.first_child, ids, -1)
+        return np.where(first[:, None] >= 0, first[:, None] + np.array([0, 1]), -1)
+
+    def clone_members(self, clone, alive_only=True):
+        """Ids in the clone descended from initial cell `clone`."""
+        ids = self.alive_ids if alive_only else np.arange(self.n_ids)
+        return ids[self.clone[ids] == clone]
+
+    def clone_sizes(self, alive_only=True):
+        """Number of (living) cells descended from each initial cell."""
+        ids = self.alive_ids if alive_only else np.arange(self.n_ids)
+        return np.bincount(self.clone[ids], minlength=self.n_roots)
+
+    def ancestors_at_depth(self, ids, depth):
+        """Ancestor of each id at the given depth (the id itself if it is not deeper)."""
+        ids = self._ids(ids).copy()
+        while True:
+            deeper = self._lookup(self.depth, ids, -1) > depth
+            if not deeper.any():
+                return ids
+            ids[deeper] = self.parent[ids[deeper]]
+
+    def mrca(self, a, b):
+        """Most recent common ancestor of each pair (a[k], b[k]) (-1 if in different clones or an id is -1)."""
+        a, b = np.broadcast_arrays(self._ids(a), self._ids(b))
+        a, b = a.copy(), b.copy()
+        different_clone = (a < 0) | (b < 0) | (self._lookup(self.clone, a, -1) != self._lookup(self.clone, b, -1))
+        while True:
+            todo = (a != b) & ~different_clone
+            if not todo.any():
+                break
+            da, db = self.depth[a], self.depth[b]
+            up_a = todo & (da >= db)
+            up_b = todo & (db >= da)
+            a[up_a] = self.parent[a[up_a]]
+            b[up_b] = self.parent[b[up_b]]
+        return np.where(different_clone, -1, a)
+
+
+def gillespie_ibm(t_start, t_stop, Ps, n_init=100, mu=0.12, sigma=0.05, rng=None, recorders=()):
+    """
+    Individual based model with symmetric division only (see individual_based_model.qmd),
+    using the array-backed CellPopulation so that each event costs one vectorised phenotype update.
+
+    Inputs:
+        t_start, t_stop = start and end time of the simulation
+        Ps = division rate per cell
+        n_init = number of initial cells, with phenotype uniform in [0, 0.1]
+        mu, sigma = drift and noise of the phenotype SDE
+        rng = numpy Generator (a new one is created if None)
+        recorders = Recorder objects deciding what is stored about the phenotypes, e.g.
+                    HistogramRecorder, SummaryRecorder, SnapshotRecorder or PhenotypeHistoryRecorder
+
+    Outputs:
+        t_list = event times
+        N_list = number of cells after each event
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    # initialise cells with phenotype in range [0,0.1] -> close to stem cell
+    cells = CellPopulation(rng.uniform(0, 0.1, size=n_init))
+    t_list = [t_start]
+    N_list = [len(cells)]
+
+    t = t_start
+    try:
+        for recorder in recorders:
+            recorder.start(t, cells)
+
+        while t < t_stop:
+
+            # Total Number of cells
+            n_cells = len(cells)
+
+            # define event propensities
+            rate_division = Ps*n_cells  # Only symmetric division
+            rates = np.array([rate_division])
+            total_rate = rates.sum()
+
+            # if no events possible, stop
+            if total_rate == 0:
+                break
+
+            # sample time to next event
+            dt = rng.exponential(1 / total_rate)
+            t = t + dt
+            for recorder in recorders:
+                recorder.advance(t, cells)
+
+            # Every time step update the phenotype of each cell
+            cells.update_phenotype(dt, rng, mu, sigma)
+
+            # choose event
+            r = rng.uniform(0, total_rate)
+            event = np.searchsorted(rates.cumsum(), r)
+
+            if event == 0:
+                # Self-renewal: GSC -> GSC + GSC
+                cells.divide(rng.integers(n_cells))
+
+            # Record data
+            t_list.append(t)
+            N_list.append(len(cells))
+            for recorder in recorders:
+                recorder.after_event(t, cells)
+
+        for recorder in recorders:
+            recorder.finish(t, cells)
+    finally:
+        for recorder in recorders:
+            recorder.close()
+
+    return np.array(t_list), np.array(N_list)
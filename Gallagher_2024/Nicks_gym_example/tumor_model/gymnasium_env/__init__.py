@@ -3,4 +3,11 @@ from gymnasium.envs.registration import register
 register(
     id="gymnasium_env/tumor_model-v0",
     entry_point="gymnasium_env.envs:tumor_model",
+    vector_entry_point="gymnasium_env.envs:TumorModelVectorEnv",
+)
+
+# Batched torch version (needs torch), only available through gym.make_vec
+register(
+    id="gymnasium_env/tumor_model_torch-v0",
+    vector_entry_point="gymnasium_env.envs.tumor_model_torch:TumorModelTorchEnv",
 )
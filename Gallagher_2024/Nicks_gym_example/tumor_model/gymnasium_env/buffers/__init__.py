@@ -0,0 +1 @@
+from gymnasium_env.buffers.replay_buffer import Batch, ReplayBuffer, SumTree
@@ -0,0 +1,154 @@
+from collections import namedtuple
+
+import torch
+
+
+# A batch of transitions, every field is a tensor with the batch as the first dimension.
+# indices are the buffer positions (for update_priorities) and weights the importance
+# sampling weights (ones for uniform sampling).
+Batch = namedtuple('Batch', ('state', 'action', 'reward', 'next_state', 'done', 'indices', 'weights'))
+
+
+class SumTree:
+    """
+    Binary tree over `capacity` leaves where every node holds the sum of its children,
+    stored as a flat tensor (node i has children 2i and 2i+1, the root is node 1).
+    Updates and prefix sum searches are done for a whole batch of leaves at once.
+    """
+
+    def __init__(self, capacity, device=None):
+        self.n_leaves = 1
+        while self.n_leaves < capacity:
+            self.n_leaves *= 2
+        self.depth = self.n_leaves.bit_length() - 1
+        self.tree = torch.zeros(2*self.n_leaves, dtype=torch.float64, device=device)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, leaves, values):
+        nodes = leaves + self.n_leaves
+        self.tree[nodes] = values.to(self.tree.dtype)
+        for _ in range(self.depth):
+            nodes = torch.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2*nodes] + self.tree[2*nodes + 1]
+
+    def find(self, prefix):
+        # leaf whose cumulative sum interval contains each value of prefix
+        nodes = torch.ones(prefix.shape, dtype=torch.long, device=prefix.device)
+        prefix = prefix.clone()
+        for _ in range(self.depth):
+            left = 2*nodes
+            left_sum = self.tree[left]
+            go_right = prefix > left_sum
+            prefix = torch.where(go_right, prefix - left_sum, prefix)
+            nodes = left + go_right
+        return nodes - self.n_leaves
+
+
+class ReplayBuffer:
+    """
+    Replay memory stored in preallocated ring buffer tensors.
+
+    Replaces the deque of `Transition` namedtuples used in the DQN notebooks: transitions are
+    written in place (single transitions or batches from a vector environment), final states
+    are marked with a `done` flag instead of a `None` next state and `sample` returns a
+    `Batch` of tensors that can be used directly in `optimize_model`, e.g.
+
+        q = policy_net(batch.state).gather(1, batch.action)
+        next_q = target_net(batch.next_state).max(1).values * (1 - batch.done)
+
+    With `prioritized=True` transitions are sampled in proportion to priority**alpha using a
+    sum tree (Schaul et al. 2016), new transitions get the current maximum priority and
+    `update_priorities` should be called with the TD errors of the sampled batch.
+
+    Inputs:
+        capacity = maximum number of transitions kept
+        obs_shape = shape of a single observation
+        device = device of the storage and of the sampled batches
+        obs_dtype = dtype of the stored observations
+        prioritized = use prioritized sampling
+        alpha, beta = priority exponent and importance sampling exponent
+        eps = small constant added to the TD errors so every transition can be sampled
+        seed = seed of the sampling generator
+    """
+
+    def __init__(self, capacity, obs_shape=(1,), device="cpu", obs_dtype=torch.float32, prioritized=False, alpha=0.6, beta=0.4, eps=1e-6, seed=None):
+        self.capacity = capacity
+        self.device = torch.device(device)
+        obs_shape = tuple(obs_shape)
+
+        self.state = torch.zeros((capacity,) + obs_shape, dtype=obs_dtype, device=self.device)
+        self.next_state = torch.zeros((capacity,) + obs_shape, dtype=obs_dtype, device=self.device)
+        self.action = torch.zeros((capacity, 1), dtype=torch.long, device=self.device)
+        self.reward = torch.zeros(capacity, dtype=torch.float32, device=self.device)
+        self.done = torch.zeros(capacity, dtype=torch.float32, device=self.device)
+
+        self.pos = 0 # next position to write to
+        self.size = 0
+
+        self.generator = torch.Generator(device=self.device)
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        self.max_priority = 1.0
+        self.tree = SumTree(capacity, device=self.device) if prioritized else None
+
+    def __len__(self):
+        return self.size
+
+    def push(self, state, action, reward, next_state, done):
+        """
+        Store one transition, or a batch of transitions along the first dimension.
+        next_state of final transitions can hold anything (it is masked by done).
+        """
+        state = torch.as_tensor(state, device=self.device).reshape((-1,) + self.state.shape[1:])
+        n = state.shape[0]
+        if n > self.capacity:
+            raise ValueError(f"Cannot push {n} transitions into a buffer of capacity {self.capacity}")
+        idx = (self.pos + torch.arange(n, device=self.device)) % self.capacity
+
+        self.state[idx] = state.to(self.state.dtype)
+        self.next_state[idx] = torch.as_tensor(next_state, device=self.device).reshape(state.shape).to(self.state.dtype)
+        self.action[idx] = torch.as_tensor(action, device=self.device).reshape(n, 1).long()
+        self.reward[idx] = torch.as_tensor(reward, device=self.device).reshape(n).float()
+        self.done[idx] = torch.as_tensor(done, device=self.device).reshape(n).float()
+
+        if self.prioritized:
+            self.tree.update(idx, torch.full((n,), self.max_priority**self.alpha, dtype=torch.float64, device=self.device))
+
+        self.pos = (self.pos + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size):
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty buffer")
+
+        if self.prioritized:
+            # stratified sampling: one uniform draw from each of batch_size equal slices of the total
+            total = self.tree.total()
+            u = torch.rand(batch_size, generator=self.generator, device=self.device, dtype=torch.float64)
+            prefix = (torch.arange(batch_size, device=self.device) + u) * total / batch_size
+            indices = self.tree.find(prefix).clamp_(max=self.size - 1)
+            probs = self.tree.tree[indices + self.tree.n_leaves] / total
+            weights = (self.size * probs) ** (-self.beta)
+            weights = (weights / weights.max()).float()
+        else:
+            indices = torch.randint(0, self.size, (batch_size,), generator=self.generator, device=self.device)
+            weights = torch.ones(batch_size, device=self.device)
+
+        return Batch(self.state[indices], self.action[indices], self.reward[indices],
+                     self.next_state[indices], self.done[indices], indices, weights)
+
+    def update_priorities(self, indices, td_errors):
+        if not self.prioritized:
+            return
+        priorities = td_errors.detach().abs().to(torch.float64).reshape(-1) + self.eps
+        self.max_priority = max(self.max_priority, priorities.max().item())
+        self.tree.update(indices.to(self.device), priorities.to(self.device) ** self.alpha)
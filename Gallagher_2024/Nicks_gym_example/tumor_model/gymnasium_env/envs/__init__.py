@@ -1 +1 @@
-from gymnasium_env.envs.tumor_model import tumor_model
+from gymnasium_env.envs.tumor_model import tumor_model, TumorModelVectorEnv
@@ -0,0 +1,107 @@
+"""
+Offscreen rendering of the tumor model.
+
+A frame shows three bars, the total tumor size N (black), the sensative cells S (green) and
+the resistant cells R (red), on a scale from 0 to the carrying capacity, a blue line at the
+progression threshold and a strip along the top that is orange while treatment is on and
+grey while it is off. Frames are drawn with numpy array operations, so a whole trajectory
+is rendered in one call:
+
+    ep = RolloutStore("runs/dqn_seed0").episode(10)
+    frames = render_frames(ep["info_sensative"], ep["info_resistant"], ep["action"] == 1,
+                           threshold=1.2*0.75)
+    save_animation(frames, "episode_10.gif", fps=5)
+"""
+import io
+
+import numpy as np
+from gymnasium.error import DependencyNotInstalled
+
+
+N_COLOR = (0, 0, 0)
+S_COLOR = (0, 128, 0)
+R_COLOR = (220, 0, 0)
+THRESHOLD_COLOR = (0, 0, 255)
+ON_COLOR = (255, 165, 0)
+OFF_COLOR = (200, 200, 200)
+BACKGROUND = (255, 255, 255)
+
+
+def render_frames(s, r, treatment, k=1, threshold=None, width=240, height=240):
+    """
+    Render a trajectory.
+
+    Inputs:
+        s, r = sensative and resistant cells at each time point (arrays of length T)
+        treatment = treatment on (1/True) or off at each time point
+        k = value at the top of the plot (the carrying capacity)
+        threshold = progression threshold drawn as a line (None for no line)
+        width, height = size of the frames in pixels
+
+    Outputs:
+        uint8 array (T, height, width, 3)
+    """
+    s = np.atleast_1d(np.asarray(s, dtype=float))
+    r = np.atleast_1d(np.asarray(r, dtype=float))
+    on = np.broadcast_to(np.asarray(treatment).astype(bool), s.shape)
+    T = len(s)
+
+    frames = np.empty((T, height, width, 3), dtype=np.uint8)
+    frames[:] = BACKGROUND
+
+    # treatment strip
+    strip = max(2, height//12)
+    frames[:, :strip] = np.where(on[:, None, None, None], ON_COLOR, OFF_COLOR).astype(np.uint8)
+
+    # bars, row 0 is the top of the image
+    margin = max(2, height//20)
+    top, bottom = strip + margin, height - margin
+    rows = np.arange(height)
+    bar_width = width//5
+    gap = (width - 3*bar_width)//4
+    for j, (value, color) in enumerate(((s + r, N_COLOR), (s, S_COLOR), (r, R_COLOR))):
+        bar_top = bottom - np.round(np.clip(value/k, 0, 1)*(bottom - top)).astype(int)
+        filled = (rows[None, :] >= bar_top[:, None]) & (rows[None, :] < bottom)
+        c0 = gap + j*(bar_width + gap)
+        block = frames[:, :, c0:c0 + bar_width]
+        block[filled] = color
+
+    if threshold is not None:
+        row = bottom - int(round(min(threshold/k, 1)*(bottom - top)))
+        frames[:, max(row - 1, top):row + 1] = THRESHOLD_COLOR
+
+    return frames
+
+
+def save_animation(frames, file, fps=10, format=None):
+    """
+    Encode frames (T, H, W, 3) straight to a GIF (with PIL) or MP4 (with imageio / ffmpeg),
+    without writing the frames as images first. file is a path or a binary file object;
+    format ("gif" or "mp4") defaults to the extension of the path.
+    """
+    if format is None:
+        format = str(file).rsplit(".", 1)[-1].lower() if isinstance(file, (str, bytes)) or hasattr(file, "__fspath__") else "gif"
+
+    if format == "gif":
+        try:
+            from PIL import Image
+        except ImportError as e:
+            raise DependencyNotInstalled('Pillow is not installed, run `pip install pillow`') from e
+        images = [Image.fromarray(frame) for frame in frames]
+        images[0].save(file, format="GIF", save_all=True, append_images=images[1:],
+                       duration=int(1000/fps), loop=0)
+    elif format == "mp4":
+        try:
+            import imageio.v3 as iio
+        except ImportError as e:
+            raise DependencyNotInstalled('imageio is not installed, run `pip install imageio[ffmpeg]`') from e
+        iio.imwrite(file, np.asarray(frames), extension=".mp4", fps=fps)
+    else:
+        raise ValueError(f"Unknown animation format {format!r}, expected 'gif' or 'mp4'")
+
+
+def animation_bytes(frames, fps=10, format="gif"):
+    """Encoded animation as bytes (e.g. for IPython.display.Image(data=...))."""
+    buf = io.BytesIO()
+    save_animation(frames, buf, fps=fps, format=format)
+    return buf.getvalue()
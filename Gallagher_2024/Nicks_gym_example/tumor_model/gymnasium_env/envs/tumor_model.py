@@ -1,9 +1,14 @@
 from enum import Enum
 import gymnasium as gym
 from gymnasium import spaces
-import pygame
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+from gymnasium.error import DependencyNotInstalled
 import numpy as np
 
+from gymnasium_env.envs.propagation import rk4_propagate, propagation_table
+from gymnasium_env.envs.rendering import render_frames
+
 
 class Actions(Enum):
     off = 0
@@ -11,9 +16,9 @@ class Actions(Enum):
 
 
 class tumor_model(gym.Env):
-    # metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
+    metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
-    def __init__(self, render_mode=None,s = 0.74, r = 0.01, r_s = 0.035, r_r_mult = 0.54, d_s = 0.001*0.035, d_r = 0.001*0.035, d_D = 1.5, k = 1, term_thresh = 1.2, s0 = 0.74, r0 = 0.01, N0 = 0.75, dt = 1,freq=14):
+    def __init__(self, render_mode=None,s = 0.74, r = 0.01, r_s = 0.035, r_r_mult = 0.54, d_s = 0.001*0.035, d_r = 0.001*0.035, d_D = 1.5, k = 1, term_thresh = 1.2, s0 = 0.74, r0 = 0.01, N0 = 0.75, dt = 1,freq=14, propagation="euler"):
 
         # Define model parameters
         self.s = s # Sensative cells
@@ -34,6 +39,16 @@ class tumor_model(gym.Env):
         self.reward = 0 # Keep track of reward for each step
         self.freq = freq # Frequency of treatment
 
+        # How the model is advanced over a treatment interval: "euler" (freq Euler steps of
+        # size dt), "rk4" (RK4 over the interval) or "table" (interpolation of a tabulated
+        # interval map, see propagation.py)
+        self.propagation = propagation
+        self._table = None
+        if propagation == "table":
+            self._table = propagation_table(self.freq*self.dt, self.r_s, self.r_r, self.d_s, self.d_r, self.d_D, self.k)
+        elif propagation not in ("euler", "rk4"):
+            raise ValueError(f"Unknown propagation {propagation!r}, expected 'euler', 'rk4' or 'table'")
+
 
 
         # Observations are dictionaries with the agent's and the target's location.
@@ -57,8 +72,10 @@ class tumor_model(gym.Env):
 
         }
 
-        #assert render_mode is None or render_mode in self.metadata["render_modes"]
-        #self.render_mode = render_mode
+        assert render_mode is None or render_mode in self.metadata["render_modes"]
+        self.render_mode = render_mode
+        self.window_size = 240 # size of the rendered frames in pixels
+        self.treatment = 0 # treatment of the last step, shown in the rendered frames
 
         """
         If human-rendering is used, `self.window` will be a reference
@@ -67,8 +84,8 @@ class tumor_model(gym.Env):
         human-mode. They will remain `None` until human-mode is used for the
         first time.
         """
-        #self.window = None
-        #self.clock = None
+        self.window = None
+        self.clock = None
 
     # Helper function to get the observation of the agent (total tumor size)
     def _get_obs(self):
@@ -91,26 +108,39 @@ class tumor_model(gym.Env):
         self.N = self.s0 + self.r0
         self.time = 0
         self.reward = 0
+        self.treatment = 0
 
         # get the observation and info at initial state
         observation = self._get_obs()
         info = self._get_info()
 
-        #if self.render_mode == "human":
-        #    self._render_frame()
+        if self.render_mode == "human":
+            self._render_frame()
 
         return observation, info
 
     def step(self, action):
         # Map the action (element of {0,1,2,3}) to the direction we walk in
         treatment = self._action_to_direction[action]
-
-        for i in range(self.freq):
-            # Update the tumor size based on LV model
-            self.s = self.s + self.dt * (self.r_s*self.s*(1- (self.s + self.r)/self.k) * (1 - self.d_D*treatment) - self.d_s*self.s )
-            self.r = self.r + self.dt * ( self.r_r*self.r*(1-(self.s + self.r)/self.k) - self.d_r*self.r )
+        self.treatment = treatment
+
+        if self.propagation == "euler":
+            for i in range(self.freq):
+                # Update the tumor size based on LV model
+                self.s = self.s + self.dt * (self.r_s*self.s*(1- (self.s + self.r)/self.k) * (1 - self.d_D*treatment) - self.d_s*self.s )
+                self.r = self.r + self.dt * ( self.r_r*self.r*(1-(self.s + self.r)/self.k) - self.d_r*self.r )
+                self.N = self.s + self.r
+                self.time = self.time + self.dt
+        else:
+            # Propagate over the whole treatment interval at once
+            if self.propagation == "rk4":
+                s, r = rk4_propagate(self.s, self.r, treatment, self.freq*self.dt, self.r_s, self.r_r, self.d_s, self.d_r, self.d_D, self.k)
+            else:
+                s, r = self._table(self.s, self.r, treatment)
+            self.s = float(s)
+            self.r = float(r)
             self.N = self.s + self.r
-            self.time = self.time + self.dt
+            self.time = self.time + self.freq*self.dt
 
 
         # An episode is done if the agent has reached the target size (1.2*N0)
@@ -147,80 +177,186 @@ class tumor_model(gym.Env):
         info = self._get_info()
 
 
-        #if self.render_mode == "human":
-        #    self._render_frame()
+        if self.render_mode == "human":
+            self._render_frame()
 
         return observation, reward, terminated, False, info
 
     def render(self):
-        print("Tumor size: ", self.N)
-        if self.render_mode == "rgb_array":
+        if self.render_mode is None:
+            print("Tumor size: ", self.N)
+        elif self.render_mode == "rgb_array":
             return self._render_frame()
 
     def _render_frame(self):
-        if self.window is None and self.render_mode == "human":
+        # S, R and N bars with the progression threshold and the treatment state (see rendering.py)
+        frame = render_frames([self.s], [self.r], [self.treatment], k=self.k,
+                              threshold=self.term_thresh*self.N0,
+                              width=self.window_size, height=self.window_size)[0]
+        if self.render_mode == "rgb_array":
+            return frame
+
+        try:
+            import pygame
+        except ImportError as e:
+            raise DependencyNotInstalled(
+                'pygame is not installed, run `pip install "gymnasium[classic_control]"`'
+            ) from e
+        if self.window is None:
             pygame.init()
             pygame.display.init()
             self.window = pygame.display.set_mode((self.window_size, self.window_size))
-        if self.clock is None and self.render_mode == "human":
+        if self.clock is None:
             self.clock = pygame.time.Clock()
 
-        canvas = pygame.Surface((self.window_size, self.window_size))
-        canvas.fill((255, 255, 255))
-        pix_square_size = (
-            self.window_size / self.size
-        )  # The size of a single grid square in pixels
-
-        # First we draw the target
-        pygame.draw.rect(
-            canvas,
-            (255, 0, 0),
-            pygame.Rect(
-                pix_square_size * self._target_location,
-                (pix_square_size, pix_square_size),
-            ),
-        )
-        # Now we draw the agent
-        pygame.draw.circle(
-            canvas,
-            (0, 0, 255),
-            (self._agent_location + 0.5) * pix_square_size,
-            pix_square_size / 3,
-        )
-
-        # Finally, add some gridlines
-        for x in range(self.size + 1):
-            pygame.draw.line(
-                canvas,
-                0,
-                (0, pix_square_size * x),
-                (self.window_size, pix_square_size * x),
-                width=3,
-            )
-            pygame.draw.line(
-                canvas,
-                0,
-                (pix_square_size * x, 0),
-                (pix_square_size * x, self.window_size),
-                width=3,
-            )
+        # The following line copies our drawings to the visible window
+        self.window.blit(pygame.surfarray.make_surface(frame.transpose(1, 0, 2)), (0, 0))
+        pygame.event.pump()
+        pygame.display.update()
 
-        if self.render_mode == "human":
-            # The following line copies our drawings from `canvas` to the visible window
-            self.window.blit(canvas, canvas.get_rect())
-            pygame.event.pump()
-            pygame.display.update()
-
-            # We need to ensure that human-rendering occurs at the predefined framerate.
-            # The following line will automatically add a delay to
-            # keep the framerate stable.
-            self.clock.tick(self.metadata["render_fps"])
-        else:  # rgb_array
-            return np.transpose(
-                np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2)
-            )
+        # We need to ensure that human-rendering occurs at the predefined framerate.
+        self.clock.tick(self.metadata["render_fps"])
 
     def close(self):
         if self.window is not None:
+            import pygame
+
             pygame.display.quit()
             pygame.quit()
+            self.window = None
+
+class TumorModelVectorEnv(VectorEnv):
+    """
+    Vectorised version of `tumor_model` that steps `num_envs` patients at once.
+
+    The patient parameters `r_s`, `r_r_mult`, `d_D`, `s0` and `r0` can be given either as
+    scalars (every patient is the same) or as arrays of length `num_envs` for a virtual
+    cohort. The `freq` Euler substeps of a treatment interval are applied to all patients
+    together, the reward is the shaped reward of `tumor_model` computed on arrays and the
+    info dictionary holds arrays of the sensative and resistant cell numbers.
+
+    Patients that progressed (or were truncated) on the previous step are reset on the next
+    call to `step` (`AutoresetMode.NEXT_STEP`).
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(self, num_envs=1, render_mode=None, r_s = 0.035, r_r_mult = 0.54, d_s = 0.001*0.035, d_r = 0.001*0.035, d_D = 1.5, k = 1, term_thresh = 1.2, s0 = 0.74, r0 = 0.01, N0 = 0.75, dt = 1, freq=14, max_episode_steps=None, propagation="euler"):
+
+        self.num_envs = num_envs
+        self.render_mode = render_mode
+        self.max_episode_steps = max_episode_steps
+
+        # Per patient parameters
+        self.r_s = self._per_env(r_s) # Proliferation rate of sensative cells
+        self.r_r = self._per_env(r_r_mult)*self.r_s # Proliferation rate of resistant cells
+        self.d_D = self._per_env(d_D) # Death rate due to drug
+        self.s0 = self._per_env(s0) # Initial number of sensative cells
+        self.r0 = self._per_env(r0) # Initial number of resistant cells
+
+        # Parameters shared by all patients
+        self.d_s = d_s # Death rate of sensative cells
+        self.d_r = d_r # Death rate of resistant cells
+        self.k = k # carrying capacity of the tumor
+        self.term_thresh = term_thresh # Threshold for tumor size to terminate the episode
+        self.N0 = N0
+        self.dt = dt # Time step
+        self.freq = freq # Frequency of treatment
+
+        # "euler", "rk4" or "table", as for tumor_model
+        self.propagation = propagation
+        self._table = None
+        if propagation == "table":
+            shared = [self.r_s, self.r_r, self.d_D]
+            if any(np.any(p != p[0]) for p in shared):
+                raise ValueError("propagation='table' needs r_s, r_r_mult and d_D to be the same for all patients")
+            self._table = propagation_table(self.freq*self.dt, float(self.r_s[0]), float(self.r_r[0]), self.d_s, self.d_r, float(self.d_D[0]), self.k)
+        elif propagation not in ("euler", "rk4"):
+            raise ValueError(f"Unknown propagation {propagation!r}, expected 'euler', 'rk4' or 'table'")
+
+        self.single_observation_space = spaces.Box(low=0, high=self.k, shape=(1,), dtype=float)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.single_action_space = spaces.Discrete(2)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        self.s = self.s0.copy()
+        self.r = self.r0.copy()
+        self.time = np.zeros(num_envs)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.prev_done = np.zeros(num_envs, dtype=bool)
+
+    def _per_env(self, value):
+        value = np.asarray(value, dtype=float)
+        if value.ndim > 0 and value.shape != (self.num_envs,):
+            raise ValueError(f"Per patient parameters must be scalars or have shape ({self.num_envs},), received {value.shape}")
+        return np.broadcast_to(value, (self.num_envs,)).copy()
+
+    def _get_obs(self):
+        return (self.s + self.r)[:, None]
+
+    def _get_info(self):
+        return {
+            "sensative": self.s.copy(),
+            "resistant": self.r.copy(),
+        }
+
+    def _reset_envs(self, mask):
+        self.s[mask] = self.s0[mask]
+        self.r[mask] = self.r0[mask]
+        self.time[mask] = 0
+        self.steps[mask] = 0
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        self.prev_done = np.zeros(self.num_envs, dtype=bool)
+        return self._get_obs(), self._get_info()
+
+    def step(self, action):
+        treatment = np.asarray(action).reshape(self.num_envs)
+        drug = 1 - self.d_D*treatment
+
+        s, r = self.s, self.r
+        if self.propagation == "euler":
+            for i in range(self.freq):
+                # Update the tumor sizes based on LV model (r uses the updated s, as in tumor_model)
+                s = s + self.dt * (self.r_s*s*(1 - (s + r)/self.k)*drug - self.d_s*s)
+                r = r + self.dt * (self.r_r*r*(1 - (s + r)/self.k) - self.d_r*r)
+        elif self.propagation == "rk4":
+            s, r = rk4_propagate(s, r, treatment, self.freq*self.dt, self.r_s, self.r_r, self.d_s, self.d_r, self.d_D, self.k)
+        else:
+            s, r = self._table(s, r, treatment)
+        self.s, self.r = s, r
+        self.time = self.time + self.freq*self.dt
+        self.steps += 1
+
+        N = s + r
+        terminated = N >= self.term_thresh*self.N0
+        if self.max_episode_steps is None:
+            truncated = np.zeros(self.num_envs, dtype=bool)
+        else:
+            truncated = self.steps >= self.max_episode_steps
+
+        # Shaped reward of tumor_model.step
+        reward = np.where(terminated, -100.0, 0.1)
+        reward += (treatment == 0)
+        alive = ~terminated
+        reward += 900*(alive & (self.time >= 610))
+        reward += 60*(alive & (self.time >= 700))
+        reward += 70*(alive & (self.time >= 800))
+        reward += (self.time / 100) ** 5
+        reward -= 500*((self.time < 28) & (treatment == 0))
+
+        # Reset the patients whose episode ended in the last step
+        if self.prev_done.any():
+            self._reset_envs(self.prev_done)
+            reward[self.prev_done] = 0.0
+            terminated[self.prev_done] = False
+            truncated[self.prev_done] = False
+
+        self.prev_done = terminated | truncated
+
+        return self._get_obs(), reward, terminated, truncated, self._get_info()
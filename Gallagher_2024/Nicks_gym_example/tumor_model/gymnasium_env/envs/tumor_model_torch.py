@@ -0,0 +1,143 @@
+"""
+Torch version of the batched tumor model environment.
+
+`TumorModelTorchEnv` behaves like `TumorModelVectorEnv` but keeps the state of all patients
+in torch tensors on a given device. `step` takes a tensor of actions (e.g. the output of
+`policy_net(state).max(1).indices`) and returns observations, rewards and done flags as
+tensors, so a DQN / policy gradient rollout never converts between numpy arrays, tensors
+and Python scalars.
+
+    env = TumorModelTorchEnv(num_envs=256)
+    state, info = env.reset()
+    action = policy_net(state).max(1).indices
+    state, reward, terminated, truncated, info = env.step(action)
+
+torch is only needed for this module, it is not imported by `gymnasium_env.envs`.
+"""
+import torch
+from gymnasium import spaces
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from gymnasium_env.envs.propagation import rk4_propagate
+
+
+class TumorModelTorchEnv(VectorEnv):
+    """
+    `num_envs` tumor_model patients stepped together with torch tensors.
+
+    Parameters are as for `TumorModelVectorEnv` (`r_s`, `r_r_mult`, `d_D`, `s0` and `r0` may be
+    per patient sequences or tensors). `propagation` is "euler" or "rk4". Patients that
+    progressed on the previous step are reset on the next call to `step`.
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(self, num_envs=1, device="cpu", dtype=torch.float32, render_mode=None, r_s = 0.035, r_r_mult = 0.54, d_s = 0.001*0.035, d_r = 0.001*0.035, d_D = 1.5, k = 1, term_thresh = 1.2, s0 = 0.74, r0 = 0.01, N0 = 0.75, dt = 1, freq=14, max_episode_steps=None, propagation="euler"):
+
+        self.num_envs = num_envs
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.render_mode = render_mode
+        self.max_episode_steps = max_episode_steps
+        if propagation not in ("euler", "rk4"):
+            raise ValueError(f"Unknown propagation {propagation!r}, expected 'euler' or 'rk4'")
+        self.propagation = propagation
+
+        # Per patient parameters
+        self.r_s = self._per_env(r_s) # Proliferation rate of sensative cells
+        self.r_r = self._per_env(r_r_mult)*self.r_s # Proliferation rate of resistant cells
+        self.d_D = self._per_env(d_D) # Death rate due to drug
+        self.s0 = self._per_env(s0) # Initial number of sensative cells
+        self.r0 = self._per_env(r0) # Initial number of resistant cells
+
+        # Parameters shared by all patients
+        self.d_s = d_s # Death rate of sensative cells
+        self.d_r = d_r # Death rate of resistant cells
+        self.k = k # carrying capacity of the tumor
+        self.term_thresh = term_thresh # Threshold for tumor size to terminate the episode
+        self.N0 = N0
+        self.dt = dt # Time step
+        self.freq = freq # Frequency of treatment
+
+        self.single_observation_space = spaces.Box(low=0, high=self.k, shape=(1,), dtype=float)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.single_action_space = spaces.Discrete(2)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        self.s = self.s0.clone()
+        self.r = self.r0.clone()
+        self.time = torch.zeros(num_envs, device=self.device, dtype=dtype)
+        self.steps = torch.zeros(num_envs, device=self.device, dtype=torch.long)
+        self.prev_done = torch.zeros(num_envs, device=self.device, dtype=torch.bool)
+
+    def _per_env(self, value):
+        value = torch.as_tensor(value, device=self.device, dtype=self.dtype)
+        if value.ndim > 0 and value.shape != (self.num_envs,):
+            raise ValueError(f"Per patient parameters must be scalars or have shape ({self.num_envs},), received {tuple(value.shape)}")
+        return value.expand(self.num_envs).clone()
+
+    def _get_obs(self):
+        return (self.s + self.r).unsqueeze(1)
+
+    def _get_info(self):
+        return {
+            "sensative": self.s.clone(),
+            "resistant": self.r.clone(),
+        }
+
+    def reset(self, seed=None, options=None):
+        super().reset(seed=seed)
+        self.s = self.s0.clone()
+        self.r = self.r0.clone()
+        self.time.zero_()
+        self.steps.zero_()
+        self.prev_done.zero_()
+        return self._get_obs(), self._get_info()
+
+    @torch.no_grad()
+    def step(self, action):
+        treatment = torch.as_tensor(action, device=self.device).reshape(self.num_envs).to(self.dtype)
+
+        s, r = self.s, self.r
+        if self.propagation == "euler":
+            drug = 1 - self.d_D*treatment
+            for i in range(self.freq):
+                # Update the tumor sizes based on LV model (r uses the updated s, as in tumor_model)
+                s = s + self.dt * (self.r_s*s*(1 - (s + r)/self.k)*drug - self.d_s*s)
+                r = r + self.dt * (self.r_r*r*(1 - (s + r)/self.k) - self.d_r*r)
+        else:
+            s, r = rk4_propagate(s, r, treatment, self.freq*self.dt, self.r_s, self.r_r, self.d_s, self.d_r, self.d_D, self.k)
+        self.time = self.time + self.freq*self.dt
+        self.steps += 1
+
+        terminated = (s + r) >= self.term_thresh*self.N0
+        if self.max_episode_steps is None:
+            truncated = torch.zeros_like(terminated)
+        else:
+            truncated = self.steps >= self.max_episode_steps
+
+        # Shaped reward of tumor_model.step
+        alive = ~terminated
+        off = treatment == 0
+        reward = torch.where(terminated, -100.0, 0.1).to(self.dtype)
+        reward = (reward + off + 900*(alive & (self.time >= 610)) + 60*(alive & (self.time >= 700))
+                  + 70*(alive & (self.time >= 800)) + (self.time / 100) ** 5
+                  - 500*((self.time < 28) & off))
+
+        # Reset the patients whose episode ended in the last step (no host synchronisation)
+        done = self.prev_done
+        self.s = torch.where(done, self.s0, s)
+        self.r = torch.where(done, self.r0, r)
+        self.time = torch.where(done, 0, self.time)
+        self.steps = torch.where(done, 0, self.steps)
+        reward = torch.where(done, 0, reward)
+        terminated = terminated & ~done
+        truncated = truncated & ~done
+
+        self.prev_done = terminated | truncated
+
+        return self._get_obs(), reward, terminated, truncated, self._get_info()
@@ -0,0 +1,442 @@
+"""
+Multi-seed training and evaluation harness for the adaptive therapy agents.
+
+Each run trains one agent ("dqn", as in DQN_tutorial.qmd, or "actor_critic", a torch version
+of the actor-critic agent of actor_critic.ipynb) on `tumor_model` with a given seed and
+hyperparameters, checkpoints periodically (a killed run resumes from its last checkpoint)
+and finally records the greedy policy's time to progression. `run_experiments` runs many
+such runs in a process pool with a fixed number of torch threads per worker and
+`aggregate_results` combines the learning curves and time to progression of the seeds.
+
+    results = run_experiments(seeds=range(20), agents=("dqn", "actor_critic"), n_workers=10)
+    summary = aggregate_results(results)
+
+or from the command line
+
+    python -m gymnasium_env.training --seeds 20 --agents dqn actor_critic --workers 10
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from gymnasium_env.buffers import ReplayBuffer
+from gymnasium_env.envs.tumor_model import tumor_model
+
+
+# Default hyperparameters (those of DQN_tutorial.qmd)
+DQN_CONFIG = {
+    "num_episodes": 750,
+    "max_steps": 500, # steps (of freq days) after which an episode is cut off
+    "batch_size": 128,
+    "gamma": 0.99,
+    "eps_start": 0.9,
+    "eps_end": 0.01,
+    "eps_decay": 2500,
+    "tau": 0.005,
+    "lr": 1e-3,
+    "memory": 10000,
+    "hidden": 128,
+    "prioritized": False,
+    # the learning rate decays (StepLR) once the moving average of the durations exceeds lr_decay_days
+    "lr_decay_days": 750,
+    "lr_step_size": 10,
+    "lr_gamma": 0.75,
+}
+
+AC_CONFIG = {
+    "num_episodes": 750,
+    "max_steps": 500,
+    "gamma": 0.99,
+    "lr": 1e-2,
+    "hidden": 128,
+}
+
+
+class QNetwork(nn.Module):
+    # Q network of DQN_tutorial.qmd
+    def __init__(self, n_observations, n_actions, hidden=128):
+        super(QNetwork, self).__init__()
+        self.layer1 = nn.Linear(n_observations, hidden)
+        self.layer2 = nn.Linear(hidden, hidden)
+        self.layer3 = nn.Linear(hidden, n_actions)
+
+    def forward(self, x):
+        x = F.relu(self.layer1(x))
+        x = F.relu(self.layer2(x))
+        return self.layer3(x)
+
+    def act(self, x):
+        return self(x).argmax(1)
+
+
+class ActorCritic(nn.Module):
+    # Combined actor-critic network (as in actor_critic.ipynb)
+    def __init__(self, n_observations, n_actions, hidden=128):
+        super(ActorCritic, self).__init__()
+        self.common = nn.Linear(n_observations, hidden)
+        self.actor = nn.Linear(hidden, n_actions)
+        self.critic = nn.Linear(hidden, 1)
+
+    def forward(self, x):
+        x = F.relu(self.common(x))
+        return self.actor(x), self.critic(x)
+
+    def act(self, x):
+        return self(x)[0].argmax(1)
+
+
+def moving_average(a, n=5):
+    ret = np.cumsum(a, dtype=float)
+    ret[n:] = ret[n:] - ret[:-n]
+    return ret[n - 1:] / n
+
+
+def _save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+def _load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return None
+    return torch.load(path, weights_only=False)
+
+
+def _optimize_dqn(policy_net, target_net, optimizer, memory, cfg):
+    batch = memory.sample(cfg["batch_size"])
+    state_action_values = policy_net(batch.state).gather(1, batch.action).squeeze(1)
+    with torch.no_grad():
+        # double DQN target, final states have no next state value
+        next_actions = policy_net(batch.next_state).argmax(1, keepdim=True)
+        next_values = target_net(batch.next_state).gather(1, next_actions).squeeze(1)
+        expected = batch.reward + cfg["gamma"] * next_values * (1 - batch.done)
+
+    loss = (batch.weights * F.smooth_l1_loss(state_action_values, expected, reduction="none")).mean()
+    optimizer.zero_grad()
+    loss.backward()
+    torch.nn.utils.clip_grad_value_(policy_net.parameters(), 100)
+    optimizer.step()
+    memory.update_priorities(batch.indices, state_action_values.detach() - expected)
+
+
+def train_dqn(config=None, seed=0, env_kwargs=None, checkpoint_path=None, checkpoint_every=50):
+    """
+    Train a DQN agent on tumor_model (the training loop of DQN_tutorial.qmd with a tensor
+    replay buffer). Returns the duration (days) of every episode and the policy network.
+    """
+    cfg = {**DQN_CONFIG, **(config or {})}
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    env = tumor_model(**(env_kwargs or {}))
+    days_per_step = env.freq*env.dt
+
+    policy_net = QNetwork(1, 2, cfg["hidden"])
+    target_net = QNetwork(1, 2, cfg["hidden"])
+    target_net.load_state_dict(policy_net.state_dict())
+    optimizer = torch.optim.AdamW(policy_net.parameters(), lr=cfg["lr"], amsgrad=True)
+    scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=cfg["lr_step_size"], gamma=cfg["lr_gamma"])
+    memory = ReplayBuffer(cfg["memory"], prioritized=cfg["prioritized"], seed=seed)
+
+    durations = np.zeros(cfg["num_episodes"])
+    start, steps_done, decay = 0, 0, False
+    ckpt = _load_checkpoint(checkpoint_path)
+    if ckpt is not None:
+        # the replay memory is not checkpointed, it refills after resuming
+        policy_net.load_state_dict(ckpt["policy_net"])
+        target_net.load_state_dict(ckpt["target_net"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        scheduler.load_state_dict(ckpt["scheduler"])
+        rng.bit_generator.state = ckpt["rng"]
+        torch.set_rng_state(ckpt["torch_rng"])
+        start, steps_done, decay = ckpt["episode"] + 1, ckpt["steps_done"], ckpt["decay"]
+        durations[:start] = ckpt["durations"][:start]
+
+    for i_episode in range(start, cfg["num_episodes"]):
+        state, info = env.reset()
+        state = torch.tensor(state, dtype=torch.float32)
+        for t in range(cfg["max_steps"]):
+            eps_threshold = cfg["eps_end"] + (cfg["eps_start"] - cfg["eps_end"]) * np.exp(-1. * steps_done / cfg["eps_decay"])
+            steps_done += 1
+            if rng.random() > eps_threshold:
+                with torch.no_grad():
+                    action = int(policy_net.act(state.unsqueeze(0)))
+            else:
+                action = int(rng.integers(2))
+
+            observation, reward, terminated, truncated, info = env.step(action)
+            next_state = torch.tensor(observation, dtype=torch.float32)
+            memory.push(state, action, reward, next_state, terminated)
+            state = next_state
+
+            if len(memory) >= cfg["batch_size"]*4:
+                _optimize_dqn(policy_net, target_net, optimizer, memory, cfg)
+            if decay:
+                scheduler.step()
+
+            # Soft update of the target network's weights
+            with torch.no_grad():
+                for p_target, p in zip(target_net.parameters(), policy_net.parameters()):
+                    p_target.lerp_(p, cfg["tau"])
+
+            if terminated or truncated:
+                break
+
+        durations[i_episode] = (t + 1)*days_per_step
+        if i_episode > 30 and moving_average(durations[:i_episode+1])[-1] > cfg["lr_decay_days"]:
+            decay = True
+
+        if checkpoint_path is not None and ((i_episode + 1) % checkpoint_every == 0 or i_episode + 1 == cfg["num_episodes"]):
+            _save_checkpoint(checkpoint_path, {
+                "policy_net": policy_net.state_dict(), "target_net": target_net.state_dict(),
+                "optimizer": optimizer.state_dict(), "scheduler": scheduler.state_dict(),
+                "rng": rng.bit_generator.state, "torch_rng": torch.get_rng_state(),
+                "episode": i_episode, "steps_done": steps_done, "decay": decay, "durations": durations,
+            })
+
+    return durations, policy_net
+
+
+def train_actor_critic(config=None, seed=0, env_kwargs=None, checkpoint_path=None, checkpoint_every=50):
+    """
+    Train an actor-critic agent on tumor_model: one full episode per update with
+    standardised discounted returns and a Huber critic loss, as in actor_critic.ipynb.
+    Returns the duration (days) of every episode and the network.
+    """
+    cfg = {**AC_CONFIG, **(config or {})}
+    torch.manual_seed(seed)
+    env = tumor_model(**(env_kwargs or {}))
+    days_per_step = env.freq*env.dt
+
+    model = ActorCritic(1, 2, cfg["hidden"])
+    optimizer = torch.optim.Adam(model.parameters(), lr=cfg["lr"])
+    discounts = cfg["gamma"] ** torch.arange(cfg["max_steps"], dtype=torch.float32)
+
+    durations = np.zeros(cfg["num_episodes"])
+    start = 0
+    ckpt = _load_checkpoint(checkpoint_path)
+    if ckpt is not None:
+        model.load_state_dict(ckpt["model"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        torch.set_rng_state(ckpt["torch_rng"])
+        start = ckpt["episode"] + 1
+        durations[:start] = ckpt["durations"][:start]
+
+    for i_episode in range(start, cfg["num_episodes"]):
+        state, info = env.reset()
+        state = torch.tensor(state, dtype=torch.float32)
+        log_probs, values, rewards = [], [], []
+        for t in range(cfg["max_steps"]):
+            logits, value = model(state.unsqueeze(0))
+            dist = torch.distributions.Categorical(logits=logits[0])
+            action = dist.sample()
+            observation, reward, terminated, truncated, info = env.step(int(action))
+            log_probs.append(dist.log_prob(action))
+            values.append(value[0, 0])
+            rewards.append(reward)
+            state = torch.tensor(observation, dtype=torch.float32)
+            if terminated or truncated:
+                break
+
+        # discounted returns G_t = sum_k gamma^k r_{t+k}, standardised
+        rewards = torch.tensor(rewards, dtype=torch.float32)
+        n = len(rewards)
+        returns = torch.flip(torch.cumsum(torch.flip(rewards * discounts[:n], (0,)), 0), (0,)) / discounts[:n]
+        returns = (returns - returns.mean()) / (returns.std(unbiased=False) + 1e-8)
+        values = torch.stack(values)
+        advantage = returns - values.detach()
+        loss = -(torch.stack(log_probs) * advantage).sum() + F.huber_loss(values, returns, reduction="sum")
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        durations[i_episode] = (t + 1)*days_per_step
+
+        if checkpoint_path is not None and ((i_episode + 1) % checkpoint_every == 0 or i_episode + 1 == cfg["num_episodes"]):
+            _save_checkpoint(checkpoint_path, {
+                "model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                "torch_rng": torch.get_rng_state(), "episode": i_episode, "durations": durations,
+            })
+
+    return durations, model
+
+
+TRAINERS = {
+    "dqn": train_dqn,
+    "actor_critic": train_actor_critic,
+}
+
+
+@torch.no_grad()
+def time_to_progression(policy_net, env_kwargs=None, max_steps=1000):
+    """
+    Time (days) until the tumor exceeds the progression threshold under the greedy policy.
+    Runs that do not progress within max_steps are reported as max_steps*freq*dt days.
+    """
+    env = tumor_model(**(env_kwargs or {}))
+    state, info = env.reset()
+    for t in range(max_steps):
+        action = int(policy_net.act(torch.tensor(state, dtype=torch.float32).unsqueeze(0)))
+        state, reward, terminated, truncated, info = env.step(action)
+        if terminated:
+            break
+    return (t + 1)*env.freq*env.dt
+
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _init_worker(n_threads):
+    # pin the number of threads so that n_workers runs do not oversubscribe the cores
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    torch.set_num_threads(n_threads)
+
+
+@contextmanager
+def _pinned_threads(n_threads):
+    # _init_worker for runs in the calling process, whose settings are restored afterwards
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    saved_threads = torch.get_num_threads()
+    _init_worker(n_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(saved_threads)
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def run_single(agent, seed, config=None, config_name="default", env_kwargs=None, out_dir="runs", checkpoint_every=50, eval_steps=1000):
+    """
+    Train and evaluate one run, writing run_dir/checkpoint.pt during training and
+    run_dir/result.npz and run_dir/model.pt at the end. Finished runs are loaded, not rerun.
+    """
+    run_dir = os.path.join(out_dir, f"{agent}_{config_name}_seed{seed}")
+    os.makedirs(run_dir, exist_ok=True)
+    result_path = os.path.join(run_dir, "result.npz")
+
+    if not os.path.exists(result_path):
+        t0 = time.time()
+        durations, net = TRAINERS[agent](config, seed, env_kwargs, os.path.join(run_dir, "checkpoint.pt"), checkpoint_every)
+        ttp = time_to_progression(net, env_kwargs, eval_steps)
+        torch.save(net.state_dict(), os.path.join(run_dir, "model.pt"))
+        tmp = os.path.join(run_dir, "result.tmp.npz")
+        np.savez(tmp, durations=durations, ttp=ttp, wall_time=time.time() - t0)
+        os.replace(tmp, result_path)
+        with open(os.path.join(run_dir, "config.json"), "w") as f:
+            json.dump({"agent": agent, "seed": seed, "config_name": config_name,
+                       "config": config or {}, "env_kwargs": env_kwargs or {}}, f, indent=2)
+
+    result = np.load(result_path)
+    return {"agent": agent, "config_name": config_name, "seed": seed, "run_dir": run_dir,
+            "durations": result["durations"], "ttp": float(result["ttp"]),
+            "wall_time": float(result["wall_time"])}
+
+
+def _run_job(job):
+    return run_single(**job)
+
+
+def run_experiments(seeds, agents=("dqn",), configs=None, env_kwargs=None, out_dir="runs",
+                    n_workers=1, threads_per_worker=1, checkpoint_every=50, eval_steps=1000):
+    """
+    Train every combination of agent, named config and seed in a pool of n_workers processes.
+
+    Inputs:
+        seeds = iterable of seeds
+        agents = names of entries of TRAINERS
+        configs = dictionary name -> hyperparameter overrides (default {"default": {}})
+        env_kwargs = keyword arguments of tumor_model
+        out_dir = directory with one subdirectory per run
+        n_workers = number of processes
+        threads_per_worker = torch / BLAS threads of each process
+
+    Outputs:
+        list of per run results (see run_single)
+    """
+    configs = configs or {"default": {}}
+    jobs = [{"agent": agent, "seed": int(seed), "config": config, "config_name": name,
+             "env_kwargs": env_kwargs, "out_dir": out_dir, "checkpoint_every": checkpoint_every,
+             "eval_steps": eval_steps}
+            for agent, (name, config), seed in itertools.product(agents, configs.items(), seeds)]
+
+    if n_workers <= 1:
+        with _pinned_threads(threads_per_worker):
+            return [_run_job(job) for job in jobs]
+
+    # spawn rather than fork, forking a process that has already used torch threads can hang
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        return list(pool.map(_run_job, jobs))
+
+
+def aggregate_results(results):
+    """
+    Combine the runs of each (agent, config) over seeds.
+
+    Outputs:
+        dictionary (agent, config_name) -> {"seeds", "curves" (n_seeds x n_episodes durations),
+        "curve_mean", "curve_std", "curve_median", "curve_q25", "curve_q75",
+        "ttp" (per seed), "ttp_mean", "ttp_sem", "ttp_median", "ttp_min", "ttp_max"}
+    """
+    groups = {}
+    for res in results:
+        groups.setdefault((res["agent"], res["config_name"]), []).append(res)
+
+    summary = {}
+    for key, runs in groups.items():
+        runs = sorted(runs, key=lambda res: res["seed"])
+        n_episodes = max(len(res["durations"]) for res in runs)
+        curves = np.full((len(runs), n_episodes), np.nan)
+        for i, res in enumerate(runs):
+            curves[i, :len(res["durations"])] = res["durations"]
+        ttp = np.array([res["ttp"] for res in runs])
+        summary[key] = {
+            "seeds": [res["seed"] for res in runs],
+            "curves": curves,
+            "curve_mean": np.nanmean(curves, axis=0),
+            "curve_std": np.nanstd(curves, axis=0),
+            "curve_median": np.nanmedian(curves, axis=0),
+            "curve_q25": np.nanquantile(curves, 0.25, axis=0),
+            "curve_q75": np.nanquantile(curves, 0.75, axis=0),
+            "ttp": ttp,
+            "ttp_mean": ttp.mean(),
+            "ttp_sem": ttp.std(ddof=1)/np.sqrt(len(ttp)) if len(ttp) > 1 else np.nan,
+            "ttp_median": np.median(ttp),
+            "ttp_min": ttp.min(),
+            "ttp_max": ttp.max(),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-seed training of the adaptive therapy agents")
+    parser.add_argument("--seeds", type=int, default=20, help="number of seeds (0..seeds-1)")
+    parser.add_argument("--agents", nargs="+", default=["dqn"], choices=sorted(TRAINERS))
+    parser.add_argument("--episodes", type=int, default=None, help="override num_episodes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=1, help="threads per worker")
+    parser.add_argument("--out", default="runs")
+    args = parser.parse_args()
+
+    config = {} if args.episodes is None else {"num_episodes": args.episodes}
+    results = run_experiments(range(args.seeds), args.agents, {"default": config}, out_dir=args.out,
+                              n_workers=args.workers, threads_per_worker=args.threads)
+    for (agent, name), s in aggregate_results(results).items():
+        print(f"{agent} ({name}): TTP = {s['ttp_mean']:.0f} +/- {s['ttp_sem']:.0f} days "
+              f"(median {s['ttp_median']:.0f}) over {len(s['seeds'])} seeds")
@@ -2,3 +2,4 @@ from gymnasium_env.wrappers.clip_reward import ClipReward
 from gymnasium_env.wrappers.discrete_actions import DiscreteActions
 from gymnasium_env.wrappers.reacher_weighted_reward import ReacherRewardWrapper
 from gymnasium_env.wrappers.relative_position import RelativePosition
+from gymnasium_env.wrappers.rollout_recorder import RolloutRecorder, RolloutStore
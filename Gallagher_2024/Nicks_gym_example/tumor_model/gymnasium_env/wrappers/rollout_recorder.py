@@ -0,0 +1,163 @@
+import json
+import os
+
+import gymnasium as gym
+import numpy as np
+
+
+class RolloutRecorder(gym.Wrapper):
+    """
+    Records every transition of the wrapped env to disk.
+
+    Observations, actions, rewards, termination flags and the requested info entries are
+    written into preallocated arrays of `chunk_size` rows, which are appended to one raw
+    binary file per column in `path` when a chunk is full and at the end of every episode.
+    Memory use is therefore bounded by the chunk size however long training runs, and a
+    crash loses at most the episode in progress. Each reset records a row with the initial
+    observation (action -1, reward nan) so that episodes can be plotted from t = 0.
+    Recordings are read back lazily with `RolloutStore(path)`.
+
+    Used as a context manager the recorder is closed (and flushed) on exit.
+
+    If `path` already holds a recording with the same columns the new episodes are appended.
+    """
+
+    def __init__(self, env, path, chunk_size=4096, info_keys=("sensative", "resistant")):
+        super().__init__(env)
+        self.path = path
+        self.chunk_size = chunk_size
+        self.info_keys = tuple(info_keys)
+
+        obs_shape = tuple(np.shape(env.observation_space.sample()))
+        self.columns = {
+            "episode": ((), "<i8"),
+            "step": ((), "<i8"),
+            "observation": (obs_shape, "<f8"),
+            "action": ((), "<i8"),
+            "reward": ((), "<f8"),
+            "terminated": ((), "|b1"),
+            "truncated": ((), "|b1"),
+        }
+        self.columns.update({"info_" + key: ((), "<f8") for key in self.info_keys})
+        self._buffers = {name: np.zeros((chunk_size,) + shape, dtype=dtype)
+                         for name, (shape, dtype) in self.columns.items()}
+        self._n = 0
+
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        meta = {"columns": {name: {"shape": list(shape), "dtype": dtype} for name, (shape, dtype) in self.columns.items()}}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) != meta:
+                    raise ValueError(f"{path} holds a recording with different columns")
+            store = RolloutStore(path)
+            self.episode = store.n_episodes
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f, indent=2)
+            self.episode = 0
+        self.episode -= 1 # incremented at the first reset
+        self.t = 0
+
+    def _record(self, observation, action, reward, terminated, truncated, info):
+        if self._n == self.chunk_size:
+            self.flush()
+        row = self._n
+        buf = self._buffers
+        buf["episode"][row] = self.episode
+        buf["step"][row] = self.t
+        buf["observation"][row] = observation
+        buf["action"][row] = action
+        buf["reward"][row] = reward
+        buf["terminated"][row] = terminated
+        buf["truncated"][row] = truncated
+        for key in self.info_keys:
+            buf["info_" + key][row] = info.get(key, np.nan)
+        self._n += 1
+
+    def reset(self, *, seed=None, options=None):
+        observation, info = self.env.reset(seed=seed, options=options)
+        self.episode += 1
+        self.t = 0
+        self._record(observation, -1, np.nan, False, False, info)
+        return observation, info
+
+    def step(self, action):
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        self.t += 1
+        self._record(observation, action, reward, terminated, truncated, info)
+        if terminated or truncated:
+            self.flush()
+        return observation, reward, terminated, truncated, info
+
+    def flush(self):
+        """Append the rows recorded since the last flush to the column files."""
+        for name, buf in self._buffers.items():
+            with open(os.path.join(self.path, name + ".bin"), "ab") as f:
+                buf[:self._n].tofile(f)
+        self._n = 0
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class RolloutStore:
+    """
+    Lazy reader of a RolloutRecorder recording: every column is a read-only memmap, so only
+    the rows that are accessed (e.g. a single episode for a plot) are read from disk.
+
+        store = RolloutStore("runs/dqn_seed0")
+        ep = store.episode(10)
+        plt.plot(ep["step"]*14, ep["observation"][:, 0])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)["columns"]
+        self._columns = {}
+        self._starts = None
+
+    def __len__(self):
+        return len(self["episode"])
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            info = self.meta[name]
+            shape, dtype = tuple(info["shape"]), np.dtype(info["dtype"])
+            file = os.path.join(self.path, name + ".bin")
+            row_bytes = dtype.itemsize*int(np.prod(shape))
+            n = os.path.getsize(file)//row_bytes if os.path.exists(file) else 0
+            if n == 0:
+                self._columns[name] = np.zeros((0,) + shape, dtype=dtype)
+            else:
+                self._columns[name] = np.memmap(file, dtype=dtype, mode="r", shape=(n,) + shape)
+        return self._columns[name]
+
+    @property
+    def columns(self):
+        return list(self.meta)
+
+    @property
+    def episode_starts(self):
+        # episode numbers are non-decreasing, so episode boundaries are found by bisection
+        if self._starts is None:
+            episodes = self["episode"]
+            ids = np.arange(self.n_episodes + 1)
+            self._starts = np.searchsorted(episodes, ids) if len(episodes) else np.zeros(1, dtype=np.int64)
+        return self._starts
+
+    @property
+    def n_episodes(self):
+        episodes = self["episode"]
+        return int(episodes[-1]) + 1 if len(episodes) else 0
+
+    def episode(self, i, columns=None):
+        """Dictionary column -> array with the rows of episode i (including its reset row)."""
+        start, stop = self.episode_starts[i], self.episode_starts[i + 1]
+        return {name: np.asarray(self[name][start:stop]) for name in (columns or self.columns)}
+
+    def episode_lengths(self):
+        """Number of steps of every episode (excluding the reset row)."""
+        return np.diff(self.episode_starts) - 1
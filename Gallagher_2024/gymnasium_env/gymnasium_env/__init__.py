@@ -3,6 +3,7 @@ from gymnasium.envs.registration import register
 register(
     id="gymnasium_env/LotkaVolterra-v0",
     entry_point="gymnasium_env.envs:LotkaVolterraEnv",
+    vector_entry_point="gymnasium_env.envs:LotkaVolterraVectorEnv",
     max_episode_steps=500,
     reward_threshold=475.0,
 )
@@ -5,7 +5,7 @@ permalink: https://perma.cc/C9ZM-652R
 """
 
 import math
-from typing import Optional, Tuple, Union
+from typing import Any, Optional, Tuple, Union
 
 import numpy as np
 
@@ -13,6 +13,8 @@ import gymnasium as gym
 from gymnasium import logger, spaces
 from gymnasium.envs.classic_control import utils
 from gymnasium.error import DependencyNotInstalled
+from gymnasium.vector import AutoresetMode, VectorEnv
+from gymnasium.vector.utils import batch_space
 
 class LotkaVolterraEnv(gym.Env[np.ndarray, Union[int, np.ndarray]]):
     """
@@ -93,12 +95,13 @@ class LotkaVolterraEnv(gym.Env[np.ndarray, Union[int, np.ndarray]]):
 
     ```python
     >>> import gymnasium as gym
-    >>> envs = gym.make_vec("CartPole-v1", num_envs=3, vectorization_mode="vector_entry_point")
+    >>> import gymnasium_env
+    >>> envs = gym.make_vec("gymnasium_env/LotkaVolterra-v0", num_envs=3, vectorization_mode="vector_entry_point")
     >>> envs
-    CartPoleVectorEnv(CartPole-v1, num_envs=3)
-    >>> envs = gym.make_vec("CartPole-v1", num_envs=3, vectorization_mode="sync")
+    LotkaVolterraVectorEnv(gymnasium_env/LotkaVolterra-v0, num_envs=3)
+    >>> envs = gym.make_vec("gymnasium_env/LotkaVolterra-v0", num_envs=3, vectorization_mode="sync")
     >>> envs
-    SyncVectorEnv(CartPole-v1, num_envs=3)
+    SyncVectorEnv(gymnasium_env/LotkaVolterra-v0, num_envs=3)
 
     ```
 
@@ -350,4 +353,111 @@ class LotkaVolterraEnv(gym.Env[np.ndarray, Union[int, np.ndarray]]):
 
             pygame.display.quit()
             pygame.quit()
-            self.isopen = False
\ No newline at end of file
+            self.isopen = False
+
+
+class LotkaVolterraVectorEnv(VectorEnv):
+    """
+    Vectorised version of `LotkaVolterraEnv`.
+
+    The sensitive and resistant populations of all `num_envs` tumours are held in a single
+    `(2, num_envs)` array and advanced with one NumPy operation per step. Environments that
+    terminated or were truncated on the previous step are reset on the next call to `step`
+    (`AutoresetMode.NEXT_STEP`, as for `CartPoleVectorEnv`).
+    """
+
+    metadata = {
+        "render_modes": [],
+        "autoreset_mode": AutoresetMode.NEXT_STEP,
+    }
+
+    def __init__(
+        self,
+        num_envs: int = 1,
+        max_episode_steps: int = 500,
+        render_mode: Optional[str] = None,
+    ):
+        self.num_envs = num_envs
+        self.max_episode_steps = max_episode_steps
+        self.render_mode = render_mode
+
+        self.tau = 1  # days between state updates
+
+        # Lotka-Volterra parameters (as LotkaVolterraEnv)
+        self.r_S = 0.03  # /day # sensative cells proliferation rate
+        self.r_R = 0.5 * self.r_S # Resistiant cells proliferation rate
+        self.d_S = 0 * self.r_S # sensative cells death rate
+        self.d_R = 0 * self.r_S # Resistiant cells death rate
+        self.d_D = 1.5 # Drug induced cell killing
+        self.N_0 = 0.75 # Inital tumor size
+        self.R_0 = 0.01 * self.N_0 # Inital resistant cell population
+        self.K = 1 # Carrying capacity
+
+        self.V_threshold = 1.2*self.N_0
+
+        self.single_action_space = spaces.Discrete(2)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.single_observation_space = spaces.Box(0, self.K, shape=(1,), dtype=np.float32)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        self.state: np.ndarray | None = None
+        self.steps = np.zeros(num_envs, dtype=np.int32)
+        self.prev_done = np.zeros(num_envs, dtype=np.bool_)
+
+    def _initial_state(self, n):
+        return np.tile(np.array([[self.N_0-self.R_0], [self.R_0]], dtype=np.float32), (1, n))
+
+    def _get_obs(self):
+        return (self.state[0] + self.state[1])[:, None]
+
+    def _get_info(self):
+        return {
+            "sensitive": self.state[0].copy(),
+            "resistant": self.state[1].copy(),
+        }
+
+    def step(self, action: np.ndarray):
+        assert self.action_space.contains(
+            action
+        ), f"{action!r} ({type(action)}) invalid"
+        assert self.state is not None, "Call reset before using step method."
+
+        S, R = self.state
+        D = (np.asarray(action) == 1).astype(np.float32)
+
+        V = S+R
+        S = S + self.tau*(self.r_S*S*(1 - V/self.K)*(1-self.d_D*D) - self.d_S*S)
+        R = R + self.tau*(self.r_R*R*(1 - V/self.K) - self.d_R*R)
+        self.state = np.stack((S, R)).astype(np.float32)
+
+        terminated = V > self.V_threshold
+
+        self.steps += 1
+        truncated = self.steps >= self.max_episode_steps
+
+        reward = np.where(terminated, -1.0, 1.0).astype(np.float32)
+        reward[D == 0] += 2.5
+
+        # Reset all environments which terminated or were truncated in the last step
+        self.state[:, self.prev_done] = self._initial_state(self.prev_done.sum())
+        self.steps[self.prev_done] = 0
+        reward[self.prev_done] = 0.0
+        terminated[self.prev_done] = False
+        truncated[self.prev_done] = False
+
+        self.prev_done = np.logical_or(terminated, truncated)
+
+        return self._get_obs(), reward, terminated, truncated, self._get_info()
+
+    def reset(
+        self,
+        *,
+        seed: Optional[int] = None,
+        options: Optional[dict[str, Any]] = None,
+    ):
+        super().reset(seed=seed)
+        self.state = self._initial_state(self.num_envs)
+        self.steps = np.zeros(self.num_envs, dtype=np.int32)
+        self.prev_done = np.zeros(self.num_envs, dtype=np.bool_)
+
+        return self._get_obs(), self._get_info()
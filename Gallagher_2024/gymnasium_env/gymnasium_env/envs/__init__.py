@@ -1 +1 @@
-from gymnasium_env.envs.LotkaVolterra import LotkaVolterraEnv
+from gymnasium_env.envs.LotkaVolterra import LotkaVolterraEnv, LotkaVolterraVectorEnv
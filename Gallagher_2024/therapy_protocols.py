@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+
+
+## Treatment protocols
+# A protocol decides the drug level D of every patient that has not progressed yet from the
+# current time t, tumor sizes N, initial sizes N_0 and the previous drug levels D_prev (all
+# arrays over patients). Protocols hold no per patient state, so the evaluator can drop
+# progressed patients from the arrays.
+
+class Continuous:
+    '''Continuous therapy (standard of care), D(t) = 1'''
+    def decide(self, t, N, N_0, D_prev, rng):
+        return np.ones_like(N)
+
+
+class Adaptive:
+    '''
+    Threshold adaptive therapy (AT50 for lower = 0.5): treatment is given until N < lower*N_0,
+    then withdrawn until N >= upper*N_0 (as adaptive_therapy in Adaptive_therapy.qmd)
+    '''
+    def __init__(self, lower=0.5, upper=1.0):
+        self.lower = lower
+        self.upper = upper
+
+    def decide(self, t, N, N_0, D_prev, rng):
+        D = D_prev.copy()
+        D[N >= self.upper*N_0] = 1
+        D[N <= self.lower*N_0] = 0
+        return D
+
+
+class RandomTherapy:
+    '''Treatment switched on with probability p at every decision (as random_therapy)'''
+    def __init__(self, p=0.5):
+        self.p = p
+
+    def decide(self, t, N, N_0, D_prev, rng):
+        return (rng.random(N.shape) < self.p).astype(float)
+
+
+class Scheduled:
+    '''
+    Fixed schedule: D = schedule[k] during the k-th period of length period days, the schedule
+    repeating (e.g. Scheduled([1, 0], 14) alternates 14 days on and 14 days off)
+    '''
+    def __init__(self, schedule, period):
+        self.schedule = np.asarray(schedule, dtype=float)
+        self.period = period
+
+    def decide(self, t, N, N_0, D_prev, rng):
+        k = int(t // self.period) % len(self.schedule)
+        return np.full_like(N, self.schedule[k])
+
+
+## Virtual patients
+
+# Parameters of the virtual patient in Adaptive_therapy.qmd
+DEFAULT_PATIENT = {
+    'r_S': 0.027,
+    'r_R': 0.027,
+    'd_S': 0.1*0.027,
+    'd_R': 0.1*0.027,
+    'd_D': 1.5,
+    'K': 1.0,
+    'N_0': 0.75,
+    'R_0': 0.01*0.75,
+}
+
+
+def sample_patients(n, rng=None, r_S=0.027, d_D=1.5, K=1.0):
+    '''
+    Draw n virtual patients uniformly from the parameter ranges of the supplement
+    (r_R = 0.5-1 r_S, d_S, d_R = 0-0.5 r_S, N_0 = 0.1-0.75, R_0 = 0.001-0.1 N_0).
+
+    Outputs:
+        dictionary of parameter arrays of length n (the input of evaluate_protocol)
+    '''
+    rng = np.random.default_rng(rng)
+    N_0 = rng.uniform(0.1, 0.75, n)
+    return {
+        'r_S': np.full(n, r_S),
+        'r_R': rng.uniform(0.5, 1, n)*r_S,
+        'd_S': rng.uniform(0, 0.5, n)*r_S,
+        'd_R': rng.uniform(0, 0.5, n)*r_S,
+        'd_D': np.full(n, d_D),
+        'K': np.full(n, K),
+        'N_0': N_0,
+        'R_0': rng.uniform(0.001, 0.1, n)*N_0,
+    }
+
+
+def evaluate_protocol(protocol, patients=None, t_max=800, dt=0.8, progression=1.2, decision_every=1, rng=None, record=False):
+    '''
+    Simulate a treatment protocol for a whole cohort of patients at once (Euler steps of the
+    Lotka-Volterra model of Adaptive_therapy.qmd). Patients are removed from the arrays as
+    they progress, so the cost of a step shrinks over time.
+
+    Inputs:
+        protocol = object with a decide(t, N, N_0, D_prev, rng) method (e.g. Adaptive())
+        patients = dictionary with r_S, r_R, d_S, d_R, d_D, K, N_0, R_0, each a scalar or an
+                   array over patients (missing entries are taken from DEFAULT_PATIENT)
+        t_max = length of the simulation (days)
+        dt = time step (the default matches np.linspace(0, 800, 1001))
+        progression = progression threshold relative to N_0
+        decision_every = number of time steps between treatment decisions
+        rng = seed or numpy Generator used by random protocols
+        record = also return the N and D trajectories (arrays time x patients, NaN after progression)
+
+    Outputs:
+        dictionary with
+            ttp = time to progression of each patient (inf if not progressed by t_max)
+            progressed = whether the patient progressed before t_max
+            dose = cumulative dose, integral of D(t) up to progression or t_max
+            t, N, D = time points and trajectories (only if record)
+    '''
+    rng = np.random.default_rng(rng)
+    p = {**DEFAULT_PATIENT, **(patients or {})}
+    M = max(np.size(v) for v in p.values())
+    p = {k: np.broadcast_to(np.asarray(v, dtype=float), (M,)).copy() for k, v in p.items()}
+
+    S = p['N_0'] - p['R_0']
+    R = p['R_0'].copy()
+    D = np.ones(M)
+    active = np.arange(M)
+    ttp = np.full(M, np.inf)
+    dose = np.zeros(M)
+
+    n_steps = int(round(t_max/dt))
+    if record:
+        t_rec = np.arange(n_steps + 1)*dt
+        N_rec = np.full((n_steps + 1, M), np.nan)
+        D_rec = np.full((n_steps + 1, M), np.nan)
+        N_rec[0] = S + R
+
+    # parameters of the patients still on the trial
+    r_S, r_R, d_S, d_R, d_D, K, N_0 = (p[k] for k in ('r_S', 'r_R', 'd_S', 'd_R', 'd_D', 'K', 'N_0'))
+
+    for i in range(n_steps):
+        t = i*dt
+        N = S + R
+        if i % decision_every == 0:
+            D = protocol.decide(t, N, N_0, D, rng)
+
+        growth = 1 - N/K
+        S = S + dt*(r_S*S*growth*(1 - d_D*D) - d_S*S)
+        R = R + dt*(r_R*R*growth - d_R*R)
+        dose[active] += D*dt
+
+        if record:
+            N_rec[i + 1, active] = S + R
+            D_rec[i, active] = D
+
+        done = S + R >= progression*N_0
+        if done.any():
+            ttp[active[done]] = t + dt
+            keep = ~done
+            active = active[keep]
+            S, R, D = S[keep], R[keep], D[keep]
+            r_S, r_R, d_S, d_R, d_D, K, N_0 = (x[keep] for x in (r_S, r_R, d_S, d_R, d_D, K, N_0))
+            if active.size == 0:
+                break
+
+    result = {'ttp': ttp, 'progressed': np.isfinite(ttp), 'dose': dose}
+    if record:
+        result.update({'t': t_rec, 'N': N_rec, 'D': D_rec})
+    return result
+
+
+def compare_protocols(protocols, patients, **kwargs):
+    '''
+    Virtual trial: evaluate every protocol in the dictionary name -> protocol on the same
+    patients and return a table with the median TTP, fraction progressed and mean dose.
+    Keyword arguments are passed to evaluate_protocol.
+    '''
+    rows = {}
+    for name, protocol in protocols.items():
+        res = evaluate_protocol(protocol, patients, **kwargs)
+        rows[name] = {
+            'median TTP': np.median(res['ttp']),
+            'mean TTP (progressed)': res['ttp'][res['progressed']].mean() if res['progressed'].any() else np.nan,
+            'fraction progressed': res['progressed'].mean(),
+            'mean dose': res['dose'].mean(),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
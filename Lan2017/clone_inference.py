@@ -0,0 +1,268 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+## Clone models
+# Each model is a stoichiometric matrix (rows are reactions, columns are state variables),
+# the initial state (a single stem cell) and a function returning the reaction rates for an
+# ensemble of states X (M x nvariables) with per-realisation parameters theta (M x nparams).
+
+# Initial model: S -> S + P (omega), P -> 2P (lam/2), P -> 0 (lam/2)
+def rates_model0(X, theta):
+    omega, lam = theta[:, 0], theta[:, 1]
+    S, P = X[:, 0], X[:, 1]
+    return np.column_stack([omega*S, 0.5*lam*P, 0.5*lam*P])
+
+
+# Stem / progenitor / differentiated model, parameters (omega, epsilon, lam, Gamma)
+def rates_model_spd(X, theta):
+    omega, epsilon, lam, Gamma = theta.T
+    S, P, D = X.T
+    return np.column_stack([epsilon*omega*S, (1-epsilon)*omega*S, 0.5*lam*P, 0.5*lam*P, Gamma*D])
+
+
+# Heterogeneous exponential growth, parameters (lam, delta)
+def rates_model2(X, theta):
+    lam, delta = theta[:, 0], theta[:, 1]
+    S = X[:, 0]
+    return np.column_stack([lam*(0.5+delta)*S, lam*(0.5-delta)*S])
+
+
+MODELS = {
+    'model0': {'rates': rates_model0,
+               'stoichiometry': np.array([[0, 1], [0, 1], [0, -1]]),
+               'init': np.array([1, 0]),
+               'params': ('omega', 'lam')},
+    'spd': {'rates': rates_model_spd,
+            'stoichiometry': np.array([[1, 0, 0], [0, 1, 0], [0, 1, 0], [0, -1, 1], [0, 0, -1]]),
+            'init': np.array([1, 0, 0]),
+            'params': ('omega', 'epsilon', 'lam', 'Gamma')},
+    'model2': {'rates': rates_model2,
+               'stoichiometry': np.array([[1], [-1]]),
+               'init': np.array([1]),
+               'params': ('lam', 'delta')},
+}
+
+
+def ensemble_ssa(model, theta, tmax, rng, max_events=100000):
+    '''
+    Gillespie SSA run for a whole ensemble of realisations at once.
+
+    Every iteration advances all realisations that have not yet reached tmax by one event,
+    so the Python loop runs for the number of events of the longest realisation rather than
+    the total number of events.
+
+    Inputs:
+        model = name of an entry of MODELS
+        theta = parameters, array (M x nparams), one row per realisation
+        tmax = final time
+        rng = numpy Generator
+        max_events = cap on the number of events per realisation (as nt in stem_cell_clones.qmd)
+
+    Outputs:
+        X = state of each realisation at tmax, array (M x nvariables)
+    '''
+    spec = MODELS[model]
+    theta = np.atleast_2d(np.asarray(theta, dtype=float))
+    M = theta.shape[0]
+    X = np.tile(spec['init'], (M, 1)).astype(np.int64)
+    t = np.zeros(M)
+    active = np.arange(M)
+
+    for _ in range(max_events):
+        if active.size == 0:
+            break
+        rates = spec['rates'](X[active], theta[active])
+        r = rates.cumsum(axis=1)
+        rtot = r[:, -1]
+        # extinct realisations can not change any further
+        alive = rtot > 0
+        active, r, rtot = active[alive], r[alive], rtot[alive]
+        t[active] += rng.exponential(size=active.size)/rtot
+        running = t[active] < tmax
+        active, r, rtot = active[running], r[running], rtot[running]
+        # reaction: first interval end point that rtot_rand is less than
+        rtot_rand = rtot*rng.uniform(size=active.size)
+        reaction = (r < rtot_rand[:, None]).sum(axis=1)
+        X[active] += spec['stoichiometry'][reaction]
+
+    return X
+
+
+# Funtion to calcualate useful statistics of the distibutions of final sizes (as in stem_cell_clones.qmd)
+def size_freq_stats(final_size):
+    size_freq_order = pd.Series(final_size).value_counts(normalize=True)
+    size_freq = pd.Series.sort_index(size_freq_order)
+    size_freq_mean = np.sum(size_freq.index*np.transpose(size_freq.values))
+    mu_n = (size_freq_mean - np.cumsum(size_freq.index*np.transpose(size_freq.values)))/size_freq_mean
+    return size_freq, size_freq_mean, mu_n
+
+
+def summary_statistics(final_size, size_grid):
+    '''
+    Summary vector of a sample of final clone sizes: the mean size followed by the first
+    incomplete moment mu_n evaluated at the clone sizes in size_grid.
+    '''
+    size_freq, size_freq_mean, mu_n = size_freq_stats(final_size)
+    sizes = np.asarray(size_freq.index, dtype=float)
+    mu_n = np.asarray(mu_n, dtype=float)
+    # mu_n is a step function of the clone size, equal to 1 below the smallest observed size
+    idx = np.searchsorted(sizes, size_grid, side='right') - 1
+    mu_grid = np.where(idx >= 0, mu_n[np.maximum(idx, 0)], 1.0)
+    return np.concatenate([[size_freq_mean], mu_grid])
+
+
+def _simulate_summaries(model, theta, n_clones, tmax, size_grid, seed):
+    # simulate n_clones clones for each parameter set in theta and return their summaries
+    rng = np.random.default_rng(seed)
+    X = ensemble_ssa(model, np.repeat(theta, n_clones, axis=0), tmax, rng)
+    final_size = X.sum(axis=1).reshape(len(theta), n_clones)
+    return np.array([summary_statistics(fs, size_grid) for fs in final_size])
+
+
+def simulate_batch(model, theta, n_clones, tmax, size_grid, seed, n_chunks=1, pool=None):
+    '''
+    Summary statistics for a batch of parameter proposals. The batch is split into n_chunks
+    chunks which are simulated concurrently when a process pool is given.
+    '''
+    chunks = np.array_split(np.asarray(theta, dtype=float), max(1, n_chunks))
+    chunks = [c for c in chunks if len(c) > 0]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    if pool is None:
+        results = [_simulate_summaries(model, c, n_clones, tmax, size_grid, s) for c, s in zip(chunks, seeds)]
+    else:
+        results = list(pool.map(_simulate_summaries,
+                                [model]*len(chunks), chunks, [n_clones]*len(chunks),
+                                [tmax]*len(chunks), [size_grid]*len(chunks), seeds))
+    return np.concatenate(results)
+
+
+def _save_checkpoint(path, **state):
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **state)
+    os.replace(tmp, path)
+
+
+def abc_smc(final_size_obs, model, prior_low, prior_high, tmax,
+            n_particles=200, n_clones=1000, n_rounds=5, quantile=0.5, batch_size=None,
+            size_grid=None, n_workers=1, checkpoint_path=None, seed=0, verbose=True):
+    '''
+    ABC sequential Monte Carlo for the clone models.
+
+    Parameters are proposed in batches (from the uniform prior in the first round, then by
+    perturbing the previous population), each batch is simulated with the ensemble SSA across
+    n_workers processes and proposals whose summaries from size_freq_stats are within the
+    current tolerance are accepted. The tolerance of each round is the given quantile of the
+    previous population's distances.
+
+    Inputs:
+        final_size_obs = observed final clone sizes
+        model = name of an entry of MODELS
+        prior_low, prior_high = bounds of the uniform prior on the parameters
+        tmax = time at which the clone sizes were observed
+        n_particles = population size
+        n_clones = number of clones simulated per parameter proposal
+        n_rounds = number of SMC rounds
+        quantile = quantile of the previous distances used as the next tolerance
+        batch_size = number of proposals simulated together (default n_particles)
+        size_grid = clone sizes at which mu_n is compared (default quantiles of the data)
+        n_workers = number of processes used for simulation
+        checkpoint_path = .npz file the population is written to after every round;
+                          if it already exists the run resumes from it
+        seed = seed for the random number generators
+
+    Outputs:
+        dictionary with the final particles, weights, distances and the tolerance schedule
+    '''
+    prior_low = np.asarray(prior_low, dtype=float)
+    prior_high = np.asarray(prior_high, dtype=float)
+    n_params = len(prior_low)
+    if len(MODELS[model]['params']) != n_params:
+        raise ValueError(f"Model {model} has parameters {MODELS[model]['params']}, received {n_params} prior bounds")
+    if batch_size is None:
+        batch_size = n_particles
+    if size_grid is None:
+        size_grid = np.unique(np.quantile(final_size_obs, np.linspace(0.1, 0.9, 9)))
+    size_grid = np.asarray(size_grid, dtype=float)
+
+    s_obs = summary_statistics(final_size_obs, size_grid)
+
+    start_round = 0
+    particles = weights = distances = scale = None
+    epsilons = []
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        ckpt = np.load(checkpoint_path)
+        start_round = int(ckpt['round']) + 1
+        particles, weights, distances = ckpt['particles'], ckpt['weights'], ckpt['distances']
+        scale, epsilons = ckpt['scale'], list(ckpt['epsilons'])
+        if verbose:
+            print(f"Resuming from round {start_round} ({checkpoint_path})")
+
+    pool = ProcessPoolExecutor(max_workers=n_workers) if n_workers > 1 else None
+    try:
+        for round_num in range(start_round, n_rounds):
+            rng = np.random.default_rng([seed, round_num])
+
+            if round_num == 0:
+                epsilon = np.inf
+            else:
+                epsilon = np.quantile(distances, quantile)
+                cov = 2*np.atleast_2d(np.cov(particles.T, aweights=weights))
+                chol = np.linalg.cholesky(cov + 1e-12*np.eye(n_params))
+
+            accepted, accepted_d = [], []
+            n_simulated = 0
+            while sum(len(a) for a in accepted) < n_particles:
+                if round_num == 0:
+                    theta = rng.uniform(prior_low, prior_high, size=(batch_size, n_params))
+                else:
+                    parents = rng.choice(n_particles, size=batch_size, p=weights)
+                    theta = particles[parents] + rng.standard_normal((batch_size, n_params)) @ chol.T
+                    theta = theta[np.all((theta >= prior_low) & (theta <= prior_high), axis=1)]
+                    if len(theta) == 0:
+                        continue
+
+                summaries = simulate_batch(model, theta, n_clones, tmax, size_grid,
+                                           seed=rng.integers(2**32), n_chunks=n_workers, pool=pool)
+                n_simulated += len(theta)
+                if scale is None:
+                    # scale each summary by its spread under the prior
+                    scale = np.std(summaries, axis=0)
+                    scale[scale == 0] = 1.0
+                d = np.sqrt(np.sum(((summaries - s_obs)/scale)**2, axis=1))
+                keep = d <= epsilon
+                accepted.append(theta[keep])
+                accepted_d.append(d[keep])
+
+            new_particles = np.concatenate(accepted)[:n_particles]
+            new_distances = np.concatenate(accepted_d)[:n_particles]
+
+            if round_num == 0:
+                new_weights = np.ones(n_particles)
+            else:
+                # importance weights for a uniform prior and Gaussian perturbation kernel
+                inv_cov = np.linalg.inv(cov)
+                diff = new_particles[:, None, :] - particles[None, :, :]
+                kernel = np.exp(-0.5*np.einsum('ijk,kl,ijl->ij', diff, inv_cov, diff))
+                new_weights = 1.0/(kernel @ weights)
+            new_weights = new_weights/new_weights.sum()
+
+            particles, weights, distances = new_particles, new_weights, new_distances
+            epsilons.append(epsilon)
+
+            if verbose:
+                mean = np.average(particles, axis=0, weights=weights)
+                print(f"Round {round_num}: epsilon = {epsilon:.4g}, acceptance rate = {n_particles/n_simulated:.3f}, "
+                      f"posterior mean = {dict(zip(MODELS[model]['params'], np.round(mean, 4).tolist()))}")
+
+            if checkpoint_path is not None:
+                _save_checkpoint(checkpoint_path, round=round_num, particles=particles, weights=weights,
+                                 distances=distances, scale=scale, epsilons=np.array(epsilons))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return {'particles': particles, 'weights': weights, 'distances': distances,
+            'epsilons': np.array(epsilons), 'params': MODELS[model]['params']}
@@ -0,0 +1,158 @@
+import numpy as np
+from collections import OrderedDict
+from scipy import special
+
+
+# Log of the analytical solution of the asymmetric division model master equation
+# (the negative binomial form, see suppliment.qmd). Broadcasts over n, t, omega and lam.
+def log_analytical_sol(n, t, omega, lam):
+    '''
+    log P(n,t) for the asymmetric division only model
+
+    Inputs:
+        n = number of progenitor cells (array)
+        t = time (array, broadcastable with n)
+        omega = asymmetric division rate of the GSC
+        lam = symmetric division / death rate of progenitor cells
+
+    Outputs:
+        log P(n,t), same shape as the broadcast inputs
+    '''
+    n = np.asarray(n, dtype=float)
+    zeta = 2.0*np.asarray(omega, dtype=float)/lam
+    n0 = np.asarray(lam, dtype=float)*t/2.0
+    # xlogy keeps P(0,0) = 1 finite when t = 0
+    return (special.gammaln(zeta+n) - special.gammaln(zeta) - special.gammaln(n+1)
+            + special.xlogy(n, n0/(1.0+n0)) - zeta*np.log1p(n0))
+
+
+# Log of the small omega approximation P_*(n,t) ~ exp(-n/n0) / (N0 n)
+def log_neg_binomial(n, t, omega, lam):
+    n = np.asarray(n, dtype=float)
+    n0 = np.asarray(lam, dtype=float)*t/2.0
+    N0 = np.log(n0)
+    with np.errstate(divide='ignore'):
+        return -np.log(N0) - n/n0 - np.log(n)
+
+
+# Log of P_*(n,t) = P(n,t) / (1 - P(0,t)), the distribution of clones with at least one progenitor
+def log_conditional_sol(n, t, omega, lam):
+    zeta = 2.0*np.asarray(omega, dtype=float)/lam
+    n0 = np.asarray(lam, dtype=float)*t/2.0
+    log_p0 = -zeta*np.log1p(n0)
+    logP = log_analytical_sol(n, t, omega, lam)
+    with np.errstate(divide='ignore'):
+        logP = logP - np.log(-np.expm1(log_p0))
+    return np.where(np.asarray(n) >= 1, logP, -np.inf)
+
+
+# Histogram of observed clone sizes on the grid n = 0..n_max (sizes above n_max are dropped)
+def size_counts(sizes, n_max):
+    sizes = np.asarray(sizes, dtype=np.int64)
+    sizes = sizes[(sizes >= 0) & (sizes <= n_max)]
+    return np.bincount(sizes, minlength=n_max+1).astype(float)
+
+
+class CloneSizeDistribution:
+    '''
+    Evaluates log P(n,t) on a fixed (t-grid x n-grid) for many (omega, lam) pairs.
+
+    Results are cached per parameter tuple with least-recently-used eviction so that
+    repeated likelihood evaluations during optimisation do not recompute the distribution.
+
+    Inputs:
+        n_max = largest number of progenitor cells on the n grid (grid is 0..n_max)
+        t = time points at which the distribution is needed
+        maxsize = number of parameter tuples kept in the cache
+        conditional = if True use P_*(n,t) (clones with at least one progenitor)
+    '''
+
+    def __init__(self, n_max, t, maxsize=256, conditional=False):
+        self.n = np.arange(n_max+1, dtype=float)
+        self.t = np.atleast_1d(np.asarray(t, dtype=float))
+        self.maxsize = maxsize
+        self.conditional = conditional
+        self._log_sol = log_conditional_sol if conditional else log_analytical_sol
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, omega, lam):
+        return (float(omega), float(lam))
+
+    def _store(self, key, value):
+        value.setflags(write=False)
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def log_pmf(self, omega, lam):
+        '''log P(n,t) with shape (len(t), n_max+1) for a single parameter pair'''
+        key = self._key(omega, lam)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        value = self._log_sol(self.n[None, :], self.t[:, None], key[0], key[1])
+        self._store(key, value)
+        return value
+
+    def log_pmf_grid(self, params):
+        '''
+        log P(n,t) with shape (K, len(t), n_max+1) for a (K, 2) array of (omega, lam) pairs.
+        Cache misses are evaluated together in one vectorised call.
+        '''
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        keys = [self._key(omega, lam) for omega, lam in params]
+        missing = list(OrderedDict.fromkeys(k for k in keys if k not in self._cache))
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            omega, lam = np.array(missing).T
+            values = self._log_sol(self.n[None, None, :], self.t[None, :, None],
+                                   omega[:, None, None], lam[:, None, None])
+            fresh = dict(zip(missing, values))
+        else:
+            fresh = {}
+        out = np.empty((len(keys), len(self.t), len(self.n)))
+        for i, key in enumerate(keys):
+            if key in fresh:
+                out[i] = fresh[key]
+            else:
+                out[i] = self._cache[key]
+                self._cache.move_to_end(key)
+        # only keep the most recent maxsize new entries
+        for key in missing[-self.maxsize:]:
+            self._store(key, fresh[key].copy())
+        return out
+
+    def log_likelihood(self, omega, lam, counts):
+        '''
+        Log-likelihood of observed clone size counts.
+
+        Inputs:
+            counts = array (len(t), n_max+1) with the number of clones of size n observed at each t
+                     (e.g. built with size_counts)
+        '''
+        counts = np.asarray(counts, dtype=float).reshape(len(self.t), len(self.n))
+        logP = self.log_pmf(omega, lam)
+        with np.errstate(invalid='ignore'):
+            return np.sum(np.where(counts > 0, counts*logP, 0.0))
+
+    def log_likelihood_grid(self, params, counts):
+        '''Log-likelihood for each row of a (K, 2) array of (omega, lam) pairs'''
+        counts = np.asarray(counts, dtype=float).reshape(len(self.t), len(self.n))
+        logP = self.log_pmf_grid(params)
+        with np.errstate(invalid='ignore'):
+            return np.sum(np.where(counts > 0, counts*logP, 0.0), axis=(1, 2))
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._cache), 'maxsize': self.maxsize}
+
+    def cache_clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
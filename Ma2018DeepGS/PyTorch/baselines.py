@@ -0,0 +1,171 @@
+"""
+GBLUP / ridge regression baselines for the DeepGS experiments.
+
+Ridge regression on the centred markers Z (rrBLUP) and GBLUP with the genomic relationship
+matrix G = Z Z^T / p give the same predictions for lambda_GBLUP = lambda_ridge / p, so both
+are fitted in the n x n kernel form, which is cheap when n << p:
+
+    y_hat(new) = b + K(new, train) alpha,  alpha = (K(train, train) + lambda I)^-1 (y - b)
+
+K(train, train) = U diag(s) U^T is decomposed once per training set, after which alpha and
+the leave-one-out errors of every lambda cost O(n^2), so lambda is chosen by exact LOO on
+the training fold. The kernel of all samples is computed once (in blocks of markers, so
+memmaps work) and sliced for every fold; for very wide panels a randomized SVD of rank r
+replaces it by F F^T with F = U_r S_r (n x r).
+
+    results = run_baseline_cv(Markers, y, n_cvs=10)   # same folds as cross_validation.run_cv
+    summary, table = summarise_cv(results)
+"""
+import itertools
+import time
+
+import numpy as np
+
+from cross_validation import fold_metrics
+from data_loader import cvSampleIndex
+
+
+def genomic_relationship(Markers, block_size=4096):
+    """G = Z Z^T / p of the column centred markers, accumulated over blocks of markers."""
+    n, p = Markers.shape
+    G = np.zeros((n, n))
+    for start in range(0, p, block_size):
+        Z = np.asarray(Markers[:, start:start + block_size], dtype=np.float64)
+        Z -= Z.mean(axis=0)
+        G += Z @ Z.T
+    return G/p
+
+
+def randomized_svd(Markers, rank, n_oversamples=10, n_iter=4, block_size=4096, seed=0):
+    """
+    Truncated SVD U_r, s_r of the column centred markers (Halko et al. 2011), touching the
+    matrix only through products with thin matrices, one block of markers at a time.
+    """
+    n, p = Markers.shape
+    rng = np.random.default_rng(seed)
+    k = min(rank + n_oversamples, n, p)
+    means = np.concatenate([np.asarray(Markers[:, i:i + block_size], dtype=np.float64).mean(axis=0)
+                            for i in range(0, p, block_size)])
+
+    def Z_times(B):  # Z @ B, B (p x k)
+        out = np.zeros((n, B.shape[1]))
+        for i in range(0, p, block_size):
+            out += (np.asarray(Markers[:, i:i + block_size], dtype=np.float64) - means[i:i + block_size]) @ B[i:i + block_size]
+        return out
+
+    def Zt_times(A):  # Z^T @ A, A (n x k)
+        return np.concatenate([(np.asarray(Markers[:, i:i + block_size], dtype=np.float64) - means[i:i + block_size]).T @ A
+                               for i in range(0, p, block_size)])
+
+    Q, _ = np.linalg.qr(Z_times(rng.standard_normal((p, k))))
+    for _ in range(n_iter):
+        # power iterations with re-orthonormalisation sharpen the spectrum
+        Q, _ = np.linalg.qr(Zt_times(Q))
+        Q, _ = np.linalg.qr(Z_times(Q))
+    Ub, s, _ = np.linalg.svd(Zt_times(Q).T, full_matrices=False)
+    return (Q @ Ub)[:, :rank], s[:rank]
+
+
+def baseline_kernel(Markers, rank=None, seed=0):
+    """Kernel of all samples: G, or its rank-r approximation F F^T / p from randomized_svd."""
+    if rank is None:
+        return genomic_relationship(Markers)
+    U, s = randomized_svd(Markers, rank, seed=seed)
+    F = U*s
+    return F @ F.T / Markers.shape[1]
+
+
+class KernelRidgePath:
+    """
+    Kernel ridge regression with an unpenalised intercept (the GBLUP mixed model with V = K +
+    lambda I) on a training set, for any number of lambdas from one eigendecomposition of
+    the training kernel K = U diag(s) U^T:
+
+        b = 1^T V^-1 y / 1^T V^-1 1,  alpha = V^-1 (y - b 1) = P y
+    """
+
+    def __init__(self, K_train, y_train):
+        self.s, self.U = np.linalg.eigh(K_train)
+        self.s = np.clip(self.s, 0, None)
+        self.Uty = self.U.T @ np.asarray(y_train, dtype=float)
+        self.Ut1 = self.U.sum(axis=0)
+
+    def _solve(self, lam):
+        d = 1/(self.s + lam)
+        Vinv_1 = self.U @ (d*self.Ut1)
+        b = (self.Ut1 @ (d*self.Uty))/(self.Ut1 @ (d*self.Ut1))
+        alpha = self.U @ (d*(self.Uty - b*self.Ut1))
+        return b, alpha, d, Vinv_1
+
+    def alpha(self, lam):
+        return self._solve(lam)[1]
+
+    def loo_residuals(self, lam):
+        """Exact leave-one-out residuals, (P y)_i / P_ii."""
+        b, alpha, d, Vinv_1 = self._solve(lam)
+        P_diag = (self.U**2) @ d - Vinv_1**2/(self.Ut1 @ (d*self.Ut1))
+        return alpha/P_diag
+
+    def predict(self, K_cross, lam):
+        b, alpha, _, _ = self._solve(lam)
+        return b + K_cross @ alpha
+
+
+def default_lambdas(K, n=25):
+    scale = np.mean(np.diag(K))
+    return scale*np.logspace(-3, 3, n)
+
+
+def fit_baseline(K, y, trainIdx, testIdx, lambdas=None, criterion="mse"):
+    """
+    Fit kernel ridge on trainIdx with lambda chosen by LOO on the training set and predict
+    testIdx.
+
+    Outputs:
+        y_pred, chosen lambda, dictionary with lambdas and their loo_mse and loo_mae
+    """
+    lambdas = np.asarray(default_lambdas(K) if lambdas is None else lambdas, dtype=float)
+    path = KernelRidgePath(K[np.ix_(trainIdx, trainIdx)], y[trainIdx])
+    residuals = [path.loo_residuals(lam) for lam in lambdas]
+    loo = {'lambdas': lambdas,
+           'loo_mse': np.array([np.mean(r**2) for r in residuals]),
+           'loo_mae': np.array([np.mean(np.abs(r)) for r in residuals])}
+    best = lambdas[np.argmin(loo['loo_' + criterion])]
+    return path.predict(K[np.ix_(testIdx, trainIdx)], best), best, loo
+
+
+def run_baseline_cv(Markers, y, n_cvs=10, seeds=(1,), lambdas=None, rank=None, criterion="mse"):
+    """
+    GBLUP / ridge baseline on the folds of cross_validation.run_cv (cvSampleIndex with the same
+    seeds; the training part includes the samples run_cv holds out for early stopping).
+
+    Inputs:
+        Markers, y = marker matrix (n_samples x n_markers, array or memmap) and phenotypes
+        n_cvs, seeds = folds and repeats as in run_cv
+        lambdas = ridge penalties tried in every fold (default relative to the kernel scale)
+        rank = use a rank-r randomized SVD of the markers instead of the exact kernel
+        criterion = LOO error ("mse" or "mae") that selects lambda
+
+    Outputs:
+        list of per fold results with repeat, fold, testIdx, y_true, y_pred, lambda, seconds,
+        best_valid_loss (LOO MAE of the chosen lambda) and the metrics of fold_metrics;
+        kernel_seconds of the shared kernel is stored in every entry
+    """
+    y = np.asarray(y, dtype=float)
+    start = time.perf_counter()
+    K = baseline_kernel(Markers, rank=rank)
+    kernel_seconds = time.perf_counter() - start
+    lambdas = default_lambdas(K) if lambdas is None else lambdas
+
+    results = []
+    for seed, cvIdx in itertools.product(seeds, range(n_cvs)):
+        start = time.perf_counter()
+        fold = cvSampleIndex(len(y), n_cvs, rngSeed=int(seed))[cvIdx]
+        trainIdx, testIdx = fold['trainIdx'], np.atleast_1d(fold['testIdx'])
+        y_pred, lam, loo = fit_baseline(K, y, trainIdx, testIdx, lambdas, criterion)
+        results.append({'repeat': int(seed), 'fold': cvIdx, 'testIdx': testIdx, 'y_true': y[testIdx],
+                        'y_pred': y_pred, 'lambda': lam, 'seconds': time.perf_counter() - start,
+                        'kernel_seconds': kernel_seconds,
+                        'best_valid_loss': loo['loo_mae'][loo['lambdas'] == lam][0],
+                        **fold_metrics(y[testIdx], y_pred)})
+    return results
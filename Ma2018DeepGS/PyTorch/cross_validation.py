@@ -0,0 +1,131 @@
+import itertools
+import os
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from data_loader import read_wheat_data, split_data
+from deepgs_model import DeepGSModel
+from device_loader import DeviceDataLoader, compact_dtype
+from parallel import worker_pool
+from train_deepgs import train_model
+
+
+def write_shared_markers(Markers, path):
+    """One compact (int8/uint8) copy of the markers as .npy, opened read-only by every worker."""
+    dtype = {torch.uint8: np.uint8, torch.int8: np.int8}.get(compact_dtype(Markers), np.float32)
+    np.save(path, np.asarray(Markers).astype(dtype))
+
+
+def fold_metrics(y_true, y_pred):
+    """Test set metrics of a fold: Pearson correlation (as in the DeepGS paper), MAE and RMSE."""
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred = np.asarray(y_pred, dtype=float)
+    r = np.corrcoef(y_true, y_pred)[0, 1] if np.std(y_pred) > 0 else np.nan
+    return {
+        'pearson': r,
+        'mae': np.mean(np.abs(y_true - y_pred)),
+        'rmse': np.sqrt(np.mean((y_true - y_pred)**2)),
+    }
+
+
+def run_fold(markers_path, y, cnnFrame, cvIdx, n_cvs=10, rngSeed=1, valid_fraction=0.1,
+             device="cpu", train_kwargs=None):
+    """
+    Train DeepGSModel on one fold and predict its test set.
+
+    The markers are read from markers_path as a read-only memmap, so every worker shares the
+    page cache of one copy instead of receiving a pickled matrix.
+
+    Outputs:
+        dictionary with repeat (rngSeed), fold, testIdx, y_true, y_pred, best_valid_loss and
+        the metrics of fold_metrics
+    """
+    Markers = np.load(markers_path, mmap_mode='r')
+    (trainMat, trainPheno, validMat, validPheno, testMat, testPheno,
+     _, _, testIdx, markerImage) = split_data(Markers, y, cvIdx=cvIdx, n_cvs=n_cvs,
+                                              valid_fraction=valid_fraction, rngSeed=rngSeed)
+
+    train_kwargs = {'num_epochs': 200, 'patience': 20, 'batch_size': 30, 'learning_rate': 1e-3,
+                    'weight_decay': 5e-4, **(train_kwargs or {})}
+    batch_size = train_kwargs.pop('batch_size')
+    learning_rate = train_kwargs.pop('learning_rate')
+    weight_decay = train_kwargs.pop('weight_decay')
+
+    torch.manual_seed(1000*rngSeed + cvIdx)
+    device = torch.device(device)
+    train_loader = DeviceDataLoader(trainMat, trainPheno, batch_size=batch_size, shuffle=True,
+                                    device=device, image_shape=markerImage)
+    valid_loader = DeviceDataLoader(validMat, validPheno, batch_size=batch_size, shuffle=False,
+                                    device=device, image_shape=markerImage)
+    test_loader = DeviceDataLoader(testMat, testPheno, batch_size=batch_size, shuffle=False,
+                                   device=device, image_shape=markerImage)
+
+    model = DeepGSModel(cnnFrame, markerImage).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    with tempfile.TemporaryDirectory() as tmp:
+        model, best_loss = train_model(model, train_loader, valid_loader, device,
+                                       optimizer=optimizer, criterion=nn.L1Loss(),
+                                       save_path=tmp, verbose=False, **train_kwargs)
+
+    model.eval()
+    with torch.no_grad():
+        y_pred = torch.cat([model(xb) for xb, _ in test_loader]).cpu().numpy().flatten()
+
+    return {'repeat': rngSeed, 'fold': cvIdx, 'testIdx': np.asarray(testIdx), 'y_true': testPheno,
+            'y_pred': y_pred, 'best_valid_loss': best_loss, **fold_metrics(testPheno, y_pred)}
+
+
+def _run_job(job):
+    return run_fold(**job)
+
+
+def run_cv(cnnFrame, Markers=None, y=None, n_cvs=10, seeds=(1,), valid_fraction=0.1,
+           n_workers=1, threads_per_worker=1, device="cpu", train_kwargs=None, work_dir=None):
+    """
+    Repeated k-fold cross validation of a cnnFrame architecture, folds trained in parallel.
+
+    Inputs:
+        cnnFrame = architecture (see config.py)
+        Markers, y = marker matrix (n_samples x n_markers) and phenotypes (default: the wheat
+                     example, parsed once here)
+        n_cvs = number of folds
+        seeds = one repeat of the k-fold split (cvSampleIndex) per seed
+        valid_fraction = fraction of each training set held out for early stopping
+        n_workers = number of processes
+        threads_per_worker = torch / BLAS threads of each process
+        device = device of the workers
+        train_kwargs = num_epochs, patience, batch_size, learning_rate, weight_decay, grad_clip
+        work_dir = directory for the shared marker file (default: a temporary directory)
+
+    Outputs:
+        list of per fold results (see run_fold), ordered by seed then fold
+    """
+    if Markers is None:
+        Markers, y = read_wheat_data()
+    y = np.asarray(y, dtype=float)
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        markers_path = os.path.join(tmp, "markers.npy")
+        write_shared_markers(Markers, markers_path)
+
+        jobs = [{'markers_path': markers_path, 'y': y, 'cnnFrame': cnnFrame, 'cvIdx': cvIdx,
+                 'n_cvs': n_cvs, 'rngSeed': int(seed), 'valid_fraction': valid_fraction,
+                 'device': device, 'train_kwargs': train_kwargs}
+                for seed, cvIdx in itertools.product(seeds, range(n_cvs))]
+
+        with worker_pool(n_workers, threads_per_worker) as map_jobs:
+            return list(map_jobs(_run_job, jobs))
+
+
+def summarise_cv(results):
+    """Mean and standard deviation over folds of every metric, and the per fold table as arrays."""
+    metrics = ('pearson', 'mae', 'rmse', 'best_valid_loss')
+    table = {m: np.array([res[m] for res in results], dtype=float) for m in metrics}
+    summary = {}
+    for m, values in table.items():
+        summary[m + '_mean'] = np.nanmean(values)
+        summary[m + '_std'] = np.nanstd(values)
+    return summary, table
@@ -1,22 +1,26 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import os
-import rdata
-
-def load_data(save_path="saved_models"):
-    trainMat = np.load("data/train_matrix.npy")
-    trainPheno = np.load("data/train_pheno.npy")
-    validMat = np.load("data/valid_matrix.npy")
-    validPheno = np.load("data/valid_pheno.npy")
-    markerImage = (1, n_markers)  # update based on your data!
+from dataset_cache import load_genotypes
+
+# load any genotype file (.rda, .mat, .tsv, ... see dataset_cache.py) and split it into a
+# train and validation set, the held out test fold is dropped
+def load_data(path="../data/wheat_example.rda", cvIdx=0, n_cvs=10, valid_fraction=0.1, rngSeed=0, save_path="saved_models", **reader_kwargs):
+    Markers, y = load_genotypes(path, **reader_kwargs)
+    trainMat, trainPheno, validMat, validPheno, *_, markerImage = split_data(
+        Markers, y, cvIdx=cvIdx, n_cvs=n_cvs, valid_fraction=valid_fraction, rngSeed=rngSeed)
     return trainMat, trainPheno, validMat, validPheno, markerImage
 
-# load wheat and split into train-validation set and test set
-def load_wheat_data(cvIdx=0,n_cvs=10,valid_fraction=0.1,save_path="saved_models",rngSeed=0,randomise=True):
-    converted = rdata.read_rda("../data/wheat_example.rda")
-    Markers = converted['wheat_example']['Markers'].values
-    y = converted['wheat_example']['y'].values
+def read_wheat_data(path="../data/wheat_example.rda"):
+    """
+    Markers (n_samples x n_markers) and phenotypes of the DeepGS wheat example. The .rda is
+    parsed once and memory mapped from data/.cache after (see dataset_cache.py).
+    """
+    return load_genotypes(path, object_name='wheat_example')
+
 
+# split into train-validation set and test set
+def split_data(Markers, y, cvIdx=0, n_cvs=10, valid_fraction=0.1, rngSeed=0, randomise=True):
     if (randomise): 
         cvSampleList = cvSampleIndex(len(y),n_cvs,rngSeed=rngSeed)
         trainIdx = cvSampleList[cvIdx]['trainIdx']
@@ -45,6 +49,13 @@ def load_wheat_data(cvIdx=0,n_cvs=10,valid_fraction=0.1,save_path="saved_models"
     return trainMat, trainPheno, validMat, validPheno, testMat, testPheno, trainIdx[mask], trainIdx[~mask], testIdx, markerImage
 
 
+# load wheat and split into train-validation set and test set
+def load_wheat_data(cvIdx=0,n_cvs=10,valid_fraction=0.1,save_path="saved_models",rngSeed=0,randomise=True):
+    Markers, y = read_wheat_data()
+    return split_data(Markers, y, cvIdx=cvIdx, n_cvs=n_cvs, valid_fraction=valid_fraction,
+                      rngSeed=rngSeed, randomise=randomise)
+
+
 ########################generate train idx and test idx ##########################
 #' @title Generate Sample Indices for Training Sets and Testing Sets
 #' @description  This function generates indices for samples in training and testing sets for performing the N-fold cross validation experiment.
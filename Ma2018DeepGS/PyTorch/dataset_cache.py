@@ -0,0 +1,158 @@
+"""
+Cache of genotype data sets as memory-mappable arrays.
+
+The first load of a source file (R .rda/.RData, MATLAB .mat or a delimited text file)
+converts it to markers.npy (int8 when the coding is integral, float32 otherwise) and
+pheno.npy in a directory named after the SHA-256 of the source and the conversion options.
+Later loads open markers.npy with np.load(mmap_mode='r'), which takes milliseconds however
+many markers there are. The hash of a source is remembered together with its size and
+modification time in cache_dir/index.json, so unchanged files are not rehashed.
+
+    Markers, y = load_genotypes("../data/wheat_example.rda")
+
+With packed=True the markers are also stored bit-packed (packed.npy, see
+packed_genotypes.py) and returned as a PackedGenotypes over a memmap.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from packed_genotypes import PackedGenotypes, pack_genotypes
+
+
+def default_cache_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _source_hash(path, cache_dir):
+    # hash of the source, reused from the index while its size and mtime are unchanged
+    index_path = os.path.join(cache_dir, "index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    key = os.path.abspath(path)
+    st = os.stat(path)
+    entry = index.get(key)
+    if entry is not None and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return entry["sha256"]
+    digest = file_hash(path)
+    index[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = index_path + f".{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, index_path)
+    return digest
+
+
+## Readers of the source formats, returning (Markers (n_samples x n_markers), y)
+
+def _values(x):
+    return np.asarray(x.values if hasattr(x, "values") and not callable(x.values) else x)
+
+
+def read_rda(path, object_name=None, markers_key="Markers", pheno_key="y"):
+    import rdata
+    converted = rdata.read_rda(path)
+    if object_name is None:
+        object_name = next(iter(converted)) if len(converted) == 1 else None
+    data = converted[object_name] if object_name is not None else converted
+    return _values(data[markers_key]), _values(data[pheno_key])
+
+
+def read_mat(path, markers_key="Markers", pheno_key="y"):
+    from scipy.io import loadmat
+    data = loadmat(path)
+    return np.asarray(data[markers_key]), np.asarray(data[pheno_key]).ravel()
+
+
+def read_table(path, delimiter=None, pheno_column=0, skiprows=1):
+    # one sample per row, the phenotype in pheno_column and the markers in the other columns
+    if delimiter is None:
+        delimiter = "," if path.lower().endswith(".csv") else "\t"
+    table = np.loadtxt(path, delimiter=delimiter, skiprows=skiprows, ndmin=2)
+    y = table[:, pheno_column]
+    Markers = np.delete(table, pheno_column, axis=1)
+    return Markers, y
+
+
+READERS = {
+    ".rda": read_rda,
+    ".rdata": read_rda,
+    ".mat": read_mat,
+    ".tsv": read_table,
+    ".txt": read_table,
+    ".csv": read_table,
+}
+
+
+def _marker_dtype(Markers):
+    if np.array_equal(Markers, np.round(Markers)) and Markers.min() >= -128 and Markers.max() <= 127:
+        return np.int8
+    return np.float32
+
+
+def load_genotypes(path, cache_dir=None, mmap=True, refresh=False, packed=False, **reader_kwargs):
+    """
+    Markers and phenotypes of a genotype file, converted on first use and memory mapped after.
+
+    Inputs:
+        path = source file (.rda/.RData, .mat, .tsv/.txt/.csv)
+        cache_dir = cache location (default: .cache next to the source)
+        mmap = open the markers as a read-only memmap (False loads them into memory)
+        refresh = convert again even if a cache entry exists
+        packed = return the markers bit-packed (PackedGenotypes)
+        reader_kwargs = options of the reader (e.g. object_name, markers_key, pheno_key for R,
+                        delimiter, pheno_column, skiprows for text), part of the cache key
+
+    Outputs:
+        Markers (n_samples x n_markers, int8 or float32, or PackedGenotypes), y (float64)
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unknown genotype format {ext!r}, expected one of {sorted(READERS)}")
+
+    options = json.dumps(reader_kwargs, sort_keys=True)
+    key = hashlib.sha256((_source_hash(path, cache_dir) + options).encode()).hexdigest()[:16]
+    entry = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{key}")
+    markers_path = os.path.join(entry, "markers.npy")
+    pheno_path = os.path.join(entry, "pheno.npy")
+
+    if refresh or not os.path.exists(os.path.join(entry, "meta.json")):
+        Markers, y = READERS[ext](path, **reader_kwargs)
+        Markers = np.asarray(Markers)
+        os.makedirs(entry, exist_ok=True)
+        np.save(markers_path, Markers.astype(_marker_dtype(Markers)))
+        np.save(pheno_path, np.asarray(y, dtype=np.float64).ravel())
+        # meta.json is written last, so an interrupted conversion is redone
+        with open(os.path.join(entry, "meta.json"), "w") as f:
+            json.dump({"source": os.path.abspath(path), "options": reader_kwargs,
+                       "shape": list(Markers.shape)}, f, indent=2)
+
+    y = np.load(pheno_path)
+    if packed:
+        packed_path = os.path.join(entry, "packed.npy")
+        packing_path = os.path.join(entry, "packing.json")
+        if refresh or not os.path.exists(packing_path):
+            G = pack_genotypes(np.load(markers_path, mmap_mode="r"))
+            np.save(packed_path, G.data)
+            with open(packing_path, "w") as f:
+                json.dump({"n_markers": G.n_markers, "bits": G.bits, "offset": G.offset}, f)
+        with open(packing_path) as f:
+            packing = json.load(f)
+        return PackedGenotypes(np.load(packed_path, mmap_mode="r" if mmap else None), **packing), y
+
+    Markers = np.load(markers_path, mmap_mode="r" if mmap else None)
+    return Markers, y
@@ -96,6 +96,8 @@ class DeepGSModel(nn.Module):
 
     def forward(self, x):
         # print('x:',x.shape)
+        if not x.is_floating_point():
+            x = x.float()  # compact uint8/int8 markers (see DeviceDataLoader)
         x = self.conv_stack(x)
         # print('x-conv: ',x.shape)
         x = torch.flatten(x, 1)
@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+
+from packed_genotypes import PackedGenotypes, pack_genotypes, unpack_tensor
+
+
+def compact_dtype(X):
+    """
+    Smallest torch dtype that holds the marker matrix exactly: uint8 for {0,1,2} style
+    codings, int8 for {-1,0,1}, otherwise float32.
+    """
+    if not isinstance(X, torch.Tensor):
+        X = np.asarray(X)
+        integral = not np.issubdtype(X.dtype, np.floating) or np.array_equal(X, np.round(X))
+    else:
+        integral = not X.is_floating_point() or torch.equal(X, X.round())
+    if integral:
+        lo, hi = X.min().item(), X.max().item()
+        if lo >= 0 and hi <= 255:
+            return torch.uint8
+        if lo >= -128 and hi <= 127:
+            return torch.int8
+    return torch.float32
+
+
+class DeviceDataLoader:
+    """
+    Replacement for TensorDataset + DataLoader for data sets that fit in device memory.
+
+    The markers are moved to the device once, stored in a compact dtype (see compact_dtype)
+    or bit-packed (see packed_genotypes.py), and every epoch is batched by slicing an
+    on-device random permutation. Batches are unpacked / cast to out_dtype when they are
+    taken (out_dtype=None yields the compact dtype, which DeepGSModel casts itself, or
+    float32 for packed markers).
+
+    Inputs:
+        X = marker matrix (n_samples x n_markers), numpy array, tensor or PackedGenotypes
+        y = phenotypes (n_samples)
+        batch_size, shuffle, drop_last = as for DataLoader
+        device = device the data is stored on
+        image_shape = (H, W) to reshape every sample to 1 x H x W (NCHW batches)
+        storage_dtype = dtype the markers are stored in (default compact_dtype(X)), or
+                        "packed" to bit-pack them (the default for PackedGenotypes)
+        out_dtype = dtype of the marker batches
+        generator = torch Generator on device for the permutations
+    """
+
+    def __init__(self, X, y, batch_size=32, shuffle=True, drop_last=False, device="cpu",
+                 image_shape=None, storage_dtype=None, out_dtype=torch.float32, generator=None):
+        if storage_dtype == "packed" and not isinstance(X, PackedGenotypes):
+            X = pack_genotypes(X.cpu().numpy() if isinstance(X, torch.Tensor) else X)
+        y = y if isinstance(y, torch.Tensor) else torch.as_tensor(np.asarray(y))
+        self.image_shape = None if image_shape is None else (1,) + tuple(image_shape)
+        if isinstance(X, PackedGenotypes):
+            # packed rows stay packed on the device, (n_markers, bits, offset) to unpack them
+            self.packing = (X.n_markers, X.bits, X.offset)
+            self.X = torch.from_numpy(np.ascontiguousarray(X.data)).to(device)
+        else:
+            self.packing = None
+            X = X if isinstance(X, torch.Tensor) else torch.as_tensor(np.asarray(X))
+            if storage_dtype is None:
+                storage_dtype = compact_dtype(X)
+            # convert before the transfer so only the compact array is copied to the device
+            self.X = X.to(storage_dtype).to(device)
+            if self.image_shape is not None:
+                self.X = self.X.reshape((-1,) + self.image_shape)
+        self.y = y.to(device=device, dtype=torch.float32).reshape(-1, 1)
+        if len(self.X) != len(self.y):
+            raise ValueError(f"X has {len(self.X)} samples but y has {len(self.y)}")
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = self.X.device
+        self.out_dtype = out_dtype
+        self.generator = generator
+
+    def __len__(self):
+        n = len(self.X)
+        return n // self.batch_size if self.drop_last else -(-n // self.batch_size)
+
+    def _cast(self, xb):
+        if self.packing is not None:
+            xb = unpack_tensor(xb, *self.packing, dtype=self.out_dtype or torch.float32)
+            return xb if self.image_shape is None else xb.reshape((-1,) + self.image_shape)
+        return xb if self.out_dtype is None else xb.to(self.out_dtype)
+
+    def __iter__(self):
+        n = len(self.X)
+        if self.shuffle:
+            order = torch.randperm(n, device=self.device, generator=self.generator)
+        else:
+            order = None
+        for i in range(len(self)):
+            if order is None:
+                yield self._cast(self.X[i*self.batch_size:(i + 1)*self.batch_size]), self.y[i*self.batch_size:(i + 1)*self.batch_size]
+            else:
+                idx = order[i*self.batch_size:(i + 1)*self.batch_size]
+                yield self._cast(self.X.index_select(0, idx)), self.y.index_select(0, idx)
+
+    def tensors(self):
+        """The whole data set as (X, y), X unpacked / cast to out_dtype (for full-set evaluation)."""
+        return self._cast(self.X), self.y
@@ -2,6 +2,8 @@ import matplotlib.pyplot as plt
 import torch
 import numpy as np
 
+from predict import predict
+
 def plot_actual_vs_predicted(y_true, y_pred, title="Actual vs Predicted", save_path=None):
     plt.figure(figsize=(6, 6))
     plt.scatter(y_true, y_pred, alpha=0.6)
@@ -32,18 +34,10 @@ def plot_both_vs_marker(marker, y_true, y_pred, title="Pheno vs Marker", save_pa
     plt.close()
 
 # mat should be a genome matrix shape (n_samples x n_markers)
-def evaluate_model(model, mat, pheno, markerImage, device="cpu"):
-    H, W = markerImage
-
-    # Match training reshape
-    X = mat.reshape(-1, 1, H, W)
-    X = torch.tensor(X, dtype=torch.float32).to(device)
+def evaluate_model(model, mat, pheno, markerImage, device="cpu", batch_size=4096):
+    # scored in batches (see predict.py), so large panels are never converted to float at once
     y_true = pheno
-
-    model.eval()
-    with torch.no_grad():
-        preds = model(X).cpu().numpy().flatten()
-
+    preds = predict(model, mat, markerImage=markerImage, batch_size=batch_size, device=device)
     return y_true, preds
 
 # def evaluate_model(model, X, y, device="cpu"):
@@ -0,0 +1,177 @@
+"""
+Ensembles of DeepGS models trained together.
+
+The K members are ordinary DeepGSModel / LightGSModel / LightGS1D modules with different
+initialisations; their parameters are stacked along a leading member dimension and the
+forward pass is vmapped over it (torch.func), so every batch of the shared data pipeline
+goes through all members in one call. The optimiser steps the stacked tensors, which for
+Adam / SGD is the same as stepping every member on its own.
+
+    ens, history = train_ensemble(trainMat, trainPheno, validMat, validPheno, markerImage,
+                                  cnnFrame, n_members=20)
+    members = ens.predict_members(testMat)   # (20, n_test)
+    y_pred = members.mean(axis=0)
+"""
+import copy
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.func import functional_call, stack_module_state, vmap
+
+from deepgs_model import DeepGSModel, LightGSModel, LightGS1D
+from device_loader import DeviceDataLoader
+from predict import iter_batches
+
+
+def member_factory(kind, markerImage, cnnFrame=None):
+    """
+    Constructor of one member and the shape of its input without the batch dimension:
+    kind "deepgs" (needs cnnFrame), "lightgs" or "lightgs1d".
+    """
+    H, W = markerImage
+    if kind == "deepgs":
+        return (lambda: DeepGSModel(cnnFrame, markerImage)), (1, H, W)
+    if kind == "lightgs":
+        return (lambda: LightGSModel(markerImage)), (1, H, W)
+    if kind == "lightgs1d":
+        return (lambda: LightGS1D(H*W)), (1, H*W)
+    raise ValueError(f"Unknown model kind {kind!r}, expected 'deepgs', 'lightgs' or 'lightgs1d'")
+
+
+class DeepGSEnsemble(nn.Module):
+    """
+    K models of the same architecture evaluated with one vmapped call.
+
+    forward(x) takes a batch shared by all members and returns predictions (K, batch, 1).
+    """
+
+    def __init__(self, models, input_shape):
+        super().__init__()
+        params, _ = stack_module_state(models)
+        self.names = list(params)
+        self.params = nn.ParameterList([nn.Parameter(params[name].detach().clone()) for name in self.names])
+        self.input_shape = tuple(input_shape)
+        # stateless copy of the architecture, kept out of the registered submodules so that
+        # its (meta) parameters are not seen by optimisers and state_dict
+        object.__setattr__(self, "_base", copy.deepcopy(models[0]).to("meta"))
+
+    @property
+    def n_members(self):
+        return self.params[0].shape[0]
+
+    def train(self, mode=True):
+        self._base.train(mode)
+        return super().train(mode)
+
+    def forward(self, x):
+        def member(params, x):
+            return functional_call(self._base, params, (x,))
+        params = dict(zip(self.names, self.params))
+        return vmap(member, in_dims=(0, None), randomness="different")(params, x)
+
+    def member(self, k):
+        """Member k as a standalone model (e.g. for predict.predict or torch.save)."""
+        model = copy.deepcopy(self._base).to_empty(device=self.params[0].device)
+        model.load_state_dict({name: p[k].detach() for name, p in zip(self.names, self.params)})
+        return model.eval()
+
+    def predict_members(self, Markers, batch_size=4096):
+        """Predictions of every member (K x n_samples) for the rows of Markers, in batches."""
+        self.eval()
+        out = np.empty((self.n_members, len(Markers)), dtype=np.float32)
+        with torch.inference_mode():
+            for start, stop, xb in iter_batches(Markers, self.input_shape, batch_size, self.params[0].device):
+                out[:, start:stop] = self(xb).reshape(self.n_members, -1).cpu().numpy()
+        return out
+
+    def predict(self, Markers, batch_size=4096):
+        """Ensemble mean prediction."""
+        return self.predict_members(Markers, batch_size).mean(axis=0)
+
+
+def train_ensemble(
+    trainMat, trainPheno, validMat, validPheno, markerImage, cnnFrame=None,
+    n_members=10, kind="deepgs", device="cpu", eval_metric="mae",
+    num_epochs=200, batch_size=30, learning_rate=1e-3, weight_decay=5e-4,
+    patience=20, seed=0, verbose=True
+):
+    """
+    Train n_members replicas of one architecture on the same batches.
+
+    Every member keeps its own best weights (lowest validation loss); training stops when no
+    member has improved for patience epochs.
+
+    Outputs:
+        ensemble with the best weights of every member, and a history dictionary with the
+        per member train / valid loss of every epoch (epochs x members) and best epochs
+    """
+    torch.manual_seed(seed)
+    make_model, input_shape = member_factory(kind, markerImage, cnnFrame)
+    ensemble = DeepGSEnsemble([make_model() for _ in range(n_members)], input_shape).to(device)
+
+    train_loader = DeviceDataLoader(trainMat, trainPheno, batch_size=batch_size, shuffle=True,
+                                    device=device, image_shape=input_shape[1:])
+    valid_X, valid_y = DeviceDataLoader(validMat, validPheno, shuffle=False, device=device,
+                                        image_shape=input_shape[1:]).tensors()
+
+    def member_loss(pred, y):
+        # per member loss (K,), so every member gets the gradient it would get alone
+        err = pred - y
+        return err.abs().mean(dim=(1, 2)) if eval_metric == "mae" else (err**2).mean(dim=(1, 2))
+
+    optimizer = torch.optim.Adam(ensemble.parameters(), lr=learning_rate, weight_decay=weight_decay)
+
+    best_loss = torch.full((n_members,), float("inf"), device=device)
+    best_epoch = torch.full((n_members,), -1, dtype=torch.long)
+    best_params = [p.detach().clone() for p in ensemble.params]
+    history = {"train": [], "valid": []}
+    no_improve = 0
+
+    for epoch in range(num_epochs):
+        ensemble.train()
+        train_sum = torch.zeros(n_members, device=device)
+        n_train = 0
+        for xb, yb in train_loader:
+            loss = member_loss(ensemble(xb), yb)
+            optimizer.zero_grad(set_to_none=True)
+            loss.sum().backward()
+            optimizer.step()
+            train_sum += loss.detach()*len(xb)
+            n_train += len(xb)
+
+        ensemble.eval()
+        with torch.no_grad():
+            val_loss = member_loss(ensemble(valid_X), valid_y)
+        history["train"].append((train_sum/max(1, n_train)).cpu().numpy())
+        history["valid"].append(val_loss.cpu().numpy())
+
+        improved = val_loss < best_loss - 1e-12
+        if improved.any():
+            best_loss = torch.where(improved, val_loss, best_loss)
+            best_epoch[improved.cpu()] = epoch
+            with torch.no_grad():
+                for bp, p in zip(best_params, ensemble.params):
+                    bp[improved] = p[improved]
+            no_improve = 0
+        else:
+            no_improve += 1
+
+        if verbose and (epoch % 100 == 0 or epoch == num_epochs - 1):
+            val = val_loss.cpu().numpy()
+            print(f"Epoch {epoch:4d} | Val {eval_metric} members: mean {val.mean():.4f}, "
+                  f"min {val.min():.4f}, max {val.max():.4f}")
+
+        if no_improve >= patience:
+            if verbose:
+                print(f"Early stopping at epoch {epoch}.")
+            break
+
+    with torch.no_grad():
+        for bp, p in zip(best_params, ensemble.params):
+            p.copy_(bp)
+    ensemble.eval()
+
+    history = {"train": np.array(history["train"]), "valid": np.array(history["valid"]),
+               "best_loss": best_loss.cpu().numpy(), "best_epoch": best_epoch.numpy()}
+    return ensemble, history
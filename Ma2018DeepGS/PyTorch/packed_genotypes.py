@@ -0,0 +1,96 @@
+"""
+Bit-packed genotype matrices.
+
+Genotype calls take 2 ({0,1}) or 3 ({-1,0,1}, {0,1,2}) values, so they are stored as codes
+value - offset in 1 or 2 bits: 8 or 4 markers per byte instead of 4 bytes per marker as
+float32. The packed rows are unpacked to float one batch at a time (see DeviceDataLoader),
+so the float matrix of the whole panel never exists.
+
+    G = pack_genotypes(Markers)              # or load_genotypes(path, packed=True)
+    loader = DeviceDataLoader(G[trainIdx], y[trainIdx], image_shape=(1, G.n_markers))
+"""
+import numpy as np
+import torch
+
+
+class PackedGenotypes:
+    """
+    Packed genotype matrix.
+
+    Attributes:
+        data = uint8 array (n_samples x n_bytes), code of marker j of a sample in bits
+               bits*(j % per_byte) ... of byte j // per_byte (per_byte = 8 // bits)
+        n_markers = number of markers
+        bits = bits per call (1 or 2)
+        offset = value of code 0
+
+    Rows are selected with G[idx] (a PackedGenotypes), so the train / test splits of
+    data_loader.split_data work on packed data. G[rows, cols] returns unpacked values.
+    """
+
+    def __init__(self, data, n_markers, bits, offset):
+        self.data = data
+        self.n_markers = int(n_markers)
+        self.bits = int(bits)
+        self.offset = int(offset)
+
+    @property
+    def shape(self):
+        return (len(self.data), self.n_markers)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if len(key) == 2:
+                return self.unpack(key[0])[:, key[1]]
+            key, = key
+        if isinstance(key, (int, np.integer)):
+            key = [key]
+        return PackedGenotypes(self.data[key], self.n_markers, self.bits, self.offset)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def unpack(self, rows=slice(None), dtype=np.float32):
+        """Unpacked rows as a numpy array (n_rows x n_markers)."""
+        data = np.asarray(self.data[rows])
+        shifts = np.arange(0, 8, self.bits, dtype=np.uint8)
+        codes = (data[..., None] >> shifts) & ((1 << self.bits) - 1)
+        codes = codes.reshape(len(data), -1)[:, :self.n_markers]
+        return codes.astype(dtype) + np.asarray(self.offset, dtype=dtype)
+
+
+def pack_genotypes(Markers, bits=None):
+    """
+    Pack a genotype matrix (n_samples x n_markers) of integral calls spanning at most 4
+    consecutive values. bits defaults to the smallest width that holds the calls.
+    """
+    Markers = np.asarray(Markers)
+    lo, hi = int(Markers.min()), int(Markers.max())
+    if not np.array_equal(Markers, np.round(Markers)) or hi - lo > 3:
+        raise ValueError("Only integral genotype calls spanning at most 4 values can be packed")
+    needed = 1 if hi - lo <= 1 else 2
+    bits = needed if bits is None else bits
+    if bits not in (1, 2) or bits < needed:
+        raise ValueError(f"Calls between {lo} and {hi} can not be packed in {bits} bit(s)")
+
+    per_byte = 8 // bits
+    n, p = Markers.shape
+    n_bytes = -(-p // per_byte)
+    codes = np.zeros((n, n_bytes*per_byte), dtype=np.uint8)
+    codes[:, :p] = Markers - lo
+    codes = codes.reshape(n, n_bytes, per_byte) << np.arange(0, 8, bits, dtype=np.uint8)
+    return PackedGenotypes(np.bitwise_or.reduce(codes, axis=2), p, bits, lo)
+
+
+def unpack_tensor(packed, n_markers, bits, offset, dtype=torch.float32):
+    """
+    Torch version of PackedGenotypes.unpack for a uint8 tensor (n x n_bytes) on any device:
+    one shift/mask/cast over the batch, giving a (n x n_markers) tensor of dtype.
+    """
+    shifts = torch.arange(0, 8, bits, dtype=torch.uint8, device=packed.device)
+    codes = (packed.unsqueeze(-1) >> shifts) & ((1 << bits) - 1)
+    return codes.reshape(len(packed), -1)[:, :n_markers].to(dtype) + offset
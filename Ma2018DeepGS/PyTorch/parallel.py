@@ -0,0 +1,51 @@
+"""
+Process pool for training several DeepGS models side by side (cross_validation.run_cv and
+sweep.run_sweep).
+
+    with worker_pool(n_workers=4, threads_per_worker=1) as map_jobs:
+        results = list(map_jobs(run_job, jobs))
+
+Workers are started with threads_per_worker torch / BLAS threads so that n_workers trainings
+do not oversubscribe the cores. With n_workers <= 1 the jobs run in the calling process.
+
+The tumor_model gym package (Gallagher_2024) pins its workers the same way in
+gymnasium_env/training.py; the two are installed separately, so they do not share this module.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import torch
+
+
+def _start_worker(n_threads):
+    # BLAS libraries read these when the worker first loads them
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(n_threads)
+    torch.set_num_threads(n_threads)
+
+
+@contextmanager
+def worker_pool(n_workers, threads_per_worker=1):
+    """
+    Map function (like the built-in map) that runs its jobs in n_workers processes with
+    threads_per_worker threads each, or in this process if n_workers <= 1.
+    """
+    if n_workers > 1:
+        # a fresh interpreter per worker: a forked copy of a process whose torch thread pool
+        # is already running can deadlock
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                                 initializer=_start_worker, initargs=(threads_per_worker,)) as pool:
+            yield pool.map
+        return
+
+    # In this process the BLAS libraries are already loaded, so only the torch thread count
+    # can still be changed; it is restored when the block ends.
+    saved_threads = torch.get_num_threads()
+    torch.set_num_threads(threads_per_worker)
+    try:
+        yield map
+    finally:
+        torch.set_num_threads(saved_threads)
@@ -0,0 +1,155 @@
+"""
+Scoring genotypes with trained DeepGS models.
+
+train_deepGSModel / train_deepGSModel2 write best_model_<date>.json with the cnnFrame and
+markerImage next to best_model_<date>.pth, so a saved model is loaded with its path alone:
+
+    model = load_trained_model("saved_models/best_model_20250101_120000.pth")
+    model = optimise_for_inference(model, "script")
+    y_pred = predict(model, Markers, batch_size=4096)
+
+or from the command line (any genotype file that dataset_cache.load_genotypes reads):
+
+    python predict.py saved_models/best_model_20250101_120000.pth candidates.tsv --out pred.csv
+
+The markers are streamed through the model in batches under torch.inference_mode, so only
+one batch is ever held as float; memmaps and PackedGenotypes are read batch by batch.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from deepgs_model import DeepGSModel
+from packed_genotypes import PackedGenotypes
+
+
+def metadata_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def save_model_metadata(model_path, cnnFrame, markerImage):
+    """Write the cnnFrame and markerImage of a saved model next to it (see metadata_path)."""
+    with open(metadata_path(model_path), "w") as f:
+        json.dump({"cnnFrame": cnnFrame, "markerImage": [int(v) for v in markerImage]}, f, indent=2)
+
+
+def load_trained_model(model_path, cnnFrame=None, markerImage=None, device="cpu"):
+    """
+    DeepGSModel with the weights of model_path in eval mode. cnnFrame and markerImage default
+    to the metadata saved with the model and are required for models saved without it.
+    """
+    meta_file = metadata_path(model_path)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        cnnFrame = meta["cnnFrame"] if cnnFrame is None else cnnFrame
+        markerImage = meta["markerImage"] if markerImage is None else markerImage
+    if cnnFrame is None or markerImage is None:
+        raise ValueError(f"No metadata found at {meta_file}, pass cnnFrame and markerImage")
+
+    model = DeepGSModel(cnnFrame, tuple(markerImage))
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.markerImage = tuple(markerImage)
+    return model.to(device).eval()
+
+
+def set_inference_threads(n_threads=None, n_interop_threads=None):
+    """Threads of CPU inference (intra-op, and inter-op which can only be set before first use)."""
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    if n_interop_threads is not None:
+        torch.set_num_interop_threads(n_interop_threads)
+
+
+def optimise_for_inference(model, mode=None, batch_size=256):
+    """
+    Inference version of a model: mode None (as is), "script" (TorchScript, can be saved with
+    torch.jit.save and run without Python), "trace" (TorchScript by tracing a float batch of
+    batch_size) or "compile" (torch.compile).
+    """
+    model.eval()
+    if mode is None:
+        return model
+    if mode == "script":
+        return torch.jit.script(model)
+    if mode == "trace":
+        H, W = model.markerImage
+        example = torch.zeros(batch_size, 1, H, W, device=next(model.parameters()).device)
+        with torch.no_grad():
+            return torch.jit.trace(model, example)
+    if mode == "compile":
+        return torch.compile(model)
+    raise ValueError(f"Unknown inference mode {mode!r}, expected None, 'script', 'trace' or 'compile'")
+
+
+def iter_batches(Markers, input_shape, batch_size=4096, device="cpu"):
+    """
+    (start, stop, float batch of shape (stop - start,) + input_shape on device) over the rows
+    of Markers (array, memmap or PackedGenotypes), converting one batch at a time.
+    """
+    pin = torch.device(device).type == "cuda"
+    for start in range(0, len(Markers), batch_size):
+        stop = min(start + batch_size, len(Markers))
+        if isinstance(Markers, PackedGenotypes):
+            chunk = torch.from_numpy(Markers.unpack(slice(start, stop)))
+        else:
+            chunk = torch.from_numpy(np.ascontiguousarray(Markers[start:stop]))
+        if pin:
+            chunk = chunk.pin_memory()
+        yield start, stop, chunk.to(device, non_blocking=pin).to(torch.float32).reshape((-1,) + tuple(input_shape))
+
+
+def predict(model, Markers, markerImage=None, batch_size=4096, device=None):
+    """
+    Predicted phenotypes of the rows of Markers (array, memmap or PackedGenotypes), scored in
+    batches of batch_size.
+    """
+    if device is None:
+        device = next(iter(model.parameters()), torch.zeros(0)).device
+    markerImage = markerImage if markerImage is not None else getattr(model, "markerImage", None)
+    if markerImage is None:
+        markerImage = (1, Markers.shape[1])
+    model.eval()
+
+    out = np.empty(len(Markers), dtype=np.float32)
+    with torch.inference_mode():
+        for start, stop, xb in iter_batches(Markers, (1,) + tuple(markerImage), batch_size, device):
+            out[start:stop] = model(xb).reshape(-1).cpu().numpy()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score genotypes with a trained DeepGS model")
+    parser.add_argument("model", help="saved best_model*.pth (with its .json metadata)")
+    parser.add_argument("genotypes", help="genotype file (.rda, .mat, .tsv, ...)")
+    parser.add_argument("--out", help="write the predictions to this .csv or .npy file")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--threads", type=int, help="intra-op CPU threads")
+    parser.add_argument("--mode", choices=["script", "trace", "compile"], help="inference optimisation")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    from dataset_cache import load_genotypes
+
+    set_inference_threads(args.threads)
+    model = load_trained_model(args.model, device=args.device)
+    markerImage = model.markerImage
+    model = optimise_for_inference(model, args.mode)
+    Markers, _ = load_genotypes(args.genotypes)
+    y_pred = predict(model, Markers, markerImage=markerImage, batch_size=args.batch_size,
+                     device=args.device)
+
+    if args.out is None:
+        np.savetxt(sys.stdout, y_pred, fmt="%.6g")
+    elif args.out.endswith(".npy"):
+        np.save(args.out, y_pred)
+    else:
+        np.savetxt(args.out, y_pred, fmt="%.6g", header="prediction", comments="")
+
+
+if __name__ == "__main__":
+    main()
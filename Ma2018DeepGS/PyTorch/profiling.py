@@ -0,0 +1,192 @@
+"""
+Opt-in instrumentation of the DeepGS training loops.
+
+train_model, train_deepGSModel and train_deepGSModel2 take profiler=TrainingProfiler(...)
+and then record, for every epoch, the wall time, the training samples per second, the time
+spent in each phase (data: taking batches from the loader, forward, backward, optimizer,
+eval) and the peak memory. Records are appended as JSON lines to log_path and kept in
+profiler.records. The epochs in profile_epochs (start, stop) are also run under
+torch.profiler, whose chrome trace and operator table are written to trace_dir.
+
+    profiler = TrainingProfiler("profile.jsonl", profile_epochs=(5, 8), trace_dir="traces")
+    model = train_deepGSModel(..., profiler=profiler)
+    print(profiler.summary())
+
+Phases are timed after synchronising the device (sync=True), otherwise asynchronous CUDA /
+MPS kernels would be charged to whichever phase waits for them.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+PHASES = ("data", "forward", "backward", "optimizer", "eval")
+
+
+class NullProfiler:
+    """Profiler that does nothing, the default of the training loops."""
+
+    def epoch_start(self, epoch):
+        pass
+
+    def epoch_end(self, **metrics):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def iterate(self, loader):
+        return loader
+
+    def add_samples(self, n):
+        pass
+
+    def close(self):
+        pass
+
+
+class TrainingProfiler(NullProfiler):
+    """
+    Per epoch timing, throughput and memory of a training loop.
+
+    Inputs:
+        log_path = JSON lines file the epoch records are appended to (None: memory only)
+        profile_epochs = (start, stop) epochs run under torch.profiler (None: no profiling)
+        trace_dir = directory of the torch.profiler output
+        device = training device (for synchronisation and peak memory)
+        sync = synchronise the device around every phase
+    """
+
+    def __init__(self, log_path=None, profile_epochs=None, trace_dir="traces", device="cpu", sync=True):
+        self.log_path = log_path
+        self.profile_epochs = profile_epochs
+        self.trace_dir = trace_dir
+        self.device = torch.device(device)
+        self.sync = sync
+        self.records = []
+        self._torch_profiler = None
+        self._epoch = None
+
+    def _synchronize(self):
+        if not self.sync:
+            return
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elif self.device.type == "mps":
+            torch.mps.synchronize()
+
+    def _peak_memory_mb(self):
+        if self.device.type == "cuda":
+            return torch.cuda.max_memory_allocated(self.device)/2**20
+        if self.device.type == "mps":
+            return torch.mps.driver_allocated_memory()/2**20
+        if resource is not None:
+            # peak resident set size of the process (kilobytes on Linux, bytes on macOS)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss/2**20 if os.uname().sysname == "Darwin" else rss/2**10
+        return float("nan")
+
+    def epoch_start(self, epoch):
+        self._epoch = epoch
+        self._phases = dict.fromkeys(PHASES, 0.0)
+        self._samples = 0
+        if self.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(self.device)
+
+        if self.profile_epochs is not None and epoch == self.profile_epochs[0]:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device.type == "cuda":
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profiler = torch.profiler.profile(activities=activities, profile_memory=True)
+            self._torch_profiler.__enter__()
+
+        self._synchronize()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        label = torch.profiler.record_function(name) if self._torch_profiler is not None else nullcontext()
+        self._synchronize()
+        start = time.perf_counter()
+        with label:
+            yield
+            self._synchronize()
+        self._phases[name] = self._phases.get(name, 0.0) + time.perf_counter() - start
+
+    def iterate(self, loader):
+        """Iterate over loader, charging the time spent waiting for batches to the data phase."""
+        iterator = iter(loader)
+        while True:
+            with self.phase("data"):
+                batch = next(iterator, None)
+            if batch is None:
+                return
+            yield batch
+
+    def add_samples(self, n):
+        self._samples += n
+
+    def epoch_end(self, **metrics):
+        self._synchronize()
+        wall = time.perf_counter() - self._start
+        record = {
+            "epoch": self._epoch,
+            "wall_s": wall,
+            "samples": self._samples,
+            "samples_per_s": self._samples/wall if wall > 0 else float("nan"),
+            **{f"{name}_s": seconds for name, seconds in self._phases.items()},
+            "other_s": wall - sum(self._phases.values()),
+            "peak_memory_mb": self._peak_memory_mb(),
+            **{k: float(v) for k, v in metrics.items()},
+        }
+        self.records.append(record)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+        if self._torch_profiler is not None and self._epoch == self.profile_epochs[1] - 1:
+            self._stop_torch_profiler()
+
+    def _stop_torch_profiler(self):
+        self._torch_profiler.__exit__(None, None, None)
+        os.makedirs(self.trace_dir, exist_ok=True)
+        start, stop = self.profile_epochs
+        name = os.path.join(self.trace_dir, f"epochs_{start}_{stop}")
+        self._torch_profiler.export_chrome_trace(name + ".json")
+        sort_by = "cuda_time_total" if self.device.type == "cuda" else "cpu_time_total"
+        with open(name + ".txt", "w") as f:
+            f.write(self._torch_profiler.key_averages().table(sort_by=sort_by, row_limit=30))
+        self._torch_profiler = None
+
+    def close(self):
+        """Stop torch.profiler if training ended inside the profiled window."""
+        if self._torch_profiler is not None:
+            self._stop_torch_profiler()
+
+    def summary(self):
+        """Totals over the recorded epochs: seconds and fraction of wall time of every phase."""
+        if not self.records:
+            return {}
+        wall = sum(r["wall_s"] for r in self.records)
+        samples = sum(r["samples"] for r in self.records)
+        summary = {"epochs": len(self.records), "wall_s": wall, "samples_per_s": samples/wall,
+                   "peak_memory_mb": max(r["peak_memory_mb"] for r in self.records)}
+        for name in PHASES + ("other",):
+            seconds = sum(r[f"{name}_s"] for r in self.records)
+            summary[f"{name}_s"] = seconds
+            summary[f"{name}_fraction"] = seconds/wall
+        return summary
+
+
+def load_profile(log_path):
+    """Epoch records of a profile log (list of dictionaries)."""
+    with open(log_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,231 @@
+"""
+Hyperparameter sweeps over cnnFrame configurations with successive halving.
+
+A search space maps cnnFrame fields to lists of candidate values; fields that are not in
+the space are taken from the base frame (config.cnnFrame by default). Trials are sampled
+from the grid and trained in rungs of increasing epoch budgets (min_epochs, eta*min_epochs,
+... max_epochs). After every rung only the best 1/eta trials by validation MAE continue
+(eta=2 keeps the trials at or below the median). The trials of a rung are trained
+concurrently in a process pool and continue from their checkpoints in the next rung.
+
+Everything is kept in the store directory:
+    trials.json            trial id -> cnnFrame
+    results.jsonl          one line per finished (trial, rung): epochs, val_mae, seconds
+    checkpoints/<id>.pt    model / optimiser state of the trial
+so an interrupted sweep is resumed by calling run_sweep again with the same store.
+
+    space = {
+        "conv_kernel": [["1*9"], ["1*18"], ["1*36"]],
+        "conv_num_filter": [[8], [16]],
+        "drop_float": [[0.2, 0.1, 0.05], [0.4, 0.2, 0.1]],
+        "norm_layer": [None, ["GroupNorm"]],
+    }
+    trials = run_sweep(space, n_trials=12, store="sweeps/kernels", n_workers=4)
+"""
+import hashlib
+import itertools
+import json
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from config import cnnFrame as default_cnnFrame
+from cross_validation import write_shared_markers
+from data_loader import read_wheat_data, split_data
+from deepgs_model import DeepGSModel
+from device_loader import DeviceDataLoader
+from parallel import worker_pool
+from train_deepgs import train_model
+
+
+def trial_id(frame):
+    return hashlib.sha256(json.dumps(frame, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def sample_frames(space, n_trials=None, base_frame=None, seed=0):
+    """
+    cnnFrames of n_trials distinct points of the grid spanned by space (all of them if
+    n_trials is None or larger than the grid), sampled without replacement.
+    """
+    base_frame = default_cnnFrame if base_frame is None else base_frame
+    fields = list(space)
+    sizes = [len(space[f]) for f in fields]
+    n_grid = math.prod(sizes)
+    if n_trials is None or n_trials >= n_grid:
+        points = range(n_grid)
+    else:
+        points = np.random.default_rng(seed).choice(n_grid, n_trials, replace=False)
+
+    frames = []
+    for point in points:
+        frame = dict(base_frame)
+        # decode the mixed radix index of the grid point
+        for f, size in zip(reversed(fields), reversed(sizes)):
+            point, choice = divmod(int(point), size)
+            frame[f] = space[f][choice]
+        frames.append(frame)
+    return frames
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    budgets = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        budgets.append(epochs)
+        epochs *= eta
+    return budgets + [max_epochs]
+
+
+def train_trial(markers_path, y, frame, epochs, checkpoint_path, cvIdx=0, n_cvs=10, rngSeed=0,
+                valid_fraction=0.1, device="cpu", train_kwargs=None):
+    """
+    Train a trial up to a total of epochs epochs, continuing from checkpoint_path if it exists.
+
+    Outputs:
+        dictionary with epochs, val_mae (best validation MAE so far), seconds (of this call)
+        and error (message if the cnnFrame could not be built or trained, val_mae is inf)
+    """
+    start = time.perf_counter()
+    Markers = np.load(markers_path, mmap_mode='r')
+    trainMat, trainPheno, validMat, validPheno, *_, markerImage = split_data(
+        Markers, y, cvIdx=cvIdx, n_cvs=n_cvs, valid_fraction=valid_fraction, rngSeed=rngSeed)
+
+    train_kwargs = {'batch_size': 30, 'learning_rate': 1e-3, 'weight_decay': 5e-4, **(train_kwargs or {})}
+    batch_size = train_kwargs.pop('batch_size')
+    learning_rate = train_kwargs.pop('learning_rate')
+    weight_decay = train_kwargs.pop('weight_decay')
+
+    device = torch.device(device)
+    try:
+        model = DeepGSModel(frame, markerImage).to(device)
+    except (RuntimeError, ValueError, KeyError, IndexError) as e:
+        return {'epochs': epochs, 'val_mae': math.inf, 'seconds': time.perf_counter() - start, 'error': repr(e)}
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="min", factor=0.5, patience=3)
+
+    done, best = 0, math.inf
+    if os.path.exists(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location=device)
+        model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        scheduler.load_state_dict(state['scheduler'])
+        done, best = state['epochs'], state['val_mae']
+        torch.set_rng_state(state['rng'])
+    else:
+        torch.manual_seed(int(trial_id(frame), 16) % 2**31)
+
+    if epochs > done:
+        train_loader = DeviceDataLoader(trainMat, trainPheno, batch_size=batch_size, shuffle=True,
+                                        device=device, image_shape=markerImage)
+        valid_loader = DeviceDataLoader(validMat, validPheno, batch_size=batch_size, shuffle=False,
+                                        device=device, image_shape=markerImage)
+        with tempfile.TemporaryDirectory() as tmp:
+            model, loss = train_model(model, train_loader, valid_loader, device,
+                                      num_epochs=epochs - done, patience=epochs - done,
+                                      optimizer=optimizer, scheduler=scheduler, criterion=nn.L1Loss(),
+                                      save_path=tmp, verbose=False, **train_kwargs)
+        best = min(best, loss)
+        tmp_path = checkpoint_path + ".tmp"
+        torch.save({'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(), 'epochs': epochs, 'val_mae': best,
+                    'rng': torch.get_rng_state()}, tmp_path)
+        os.replace(tmp_path, checkpoint_path)
+
+    return {'epochs': epochs, 'val_mae': best, 'seconds': time.perf_counter() - start, 'error': None}
+
+
+def _run_job(job):
+    return job['trial'], job['rung'], train_trial(**job['kwargs'])
+
+
+def load_results(store):
+    """List of the result records of a sweep store (one per finished trial and rung)."""
+    path = os.path.join(store, "results.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_sweep(space, n_trials=None, base_frame=None, store="sweeps/default", min_epochs=10,
+              max_epochs=270, eta=3, Markers=None, y=None, cvIdx=0, n_cvs=10, rngSeed=0,
+              valid_fraction=0.1, n_workers=1, threads_per_worker=1, device="cpu",
+              train_kwargs=None, seed=0):
+    """
+    Successive halving sweep over cnnFrame configurations.
+
+    Inputs:
+        space = dictionary cnnFrame field -> list of candidate values
+        n_trials = number of grid points to try (None: the whole grid)
+        base_frame = values of the fields not in space (default config.cnnFrame)
+        store = directory of the sweep (resumed if it exists)
+        min_epochs, max_epochs, eta = epoch budgets of the rungs and the halving rate
+        Markers, y = data (default: the wheat example), split by data_loader.split_data with
+                     cvIdx, n_cvs, rngSeed and valid_fraction; trials are ranked on the
+                     validation part, the test fold is not used
+        n_workers, threads_per_worker = processes and torch / BLAS threads per process
+        device = device of the workers
+        train_kwargs = batch_size, learning_rate, weight_decay, grad_clip
+        seed = seed of the trial sampling
+
+    Outputs:
+        list of trials, best first: dictionaries with trial, cnnFrame, epochs (reached),
+        val_mae and error
+    """
+    os.makedirs(os.path.join(store, "checkpoints"), exist_ok=True)
+    frames = {trial_id(f): f for f in sample_frames(space, n_trials, base_frame, seed)}
+
+    trials_path = os.path.join(store, "trials.json")
+    known = {}
+    if os.path.exists(trials_path):
+        with open(trials_path) as f:
+            known = json.load(f)
+    known.update(frames)
+    with open(trials_path, "w") as f:
+        json.dump(known, f, indent=2)
+
+    if Markers is None:
+        Markers, y = read_wheat_data()
+    y = np.asarray(y, dtype=float)
+    markers_path = os.path.join(store, "markers.npy")
+    write_shared_markers(Markers, markers_path)
+
+    # results of earlier (interrupted) runs of this sweep
+    results = {(r['trial'], r['rung']): r for r in load_results(store)}
+
+    def job(trial, rung, epochs):
+        return {'trial': trial, 'rung': rung, 'kwargs': {
+            'markers_path': markers_path, 'y': y, 'frame': frames[trial], 'epochs': epochs,
+            'checkpoint_path': os.path.join(store, "checkpoints", trial + ".pt"), 'cvIdx': cvIdx,
+            'n_cvs': n_cvs, 'rngSeed': rngSeed, 'valid_fraction': valid_fraction, 'device': device,
+            'train_kwargs': train_kwargs}}
+
+    alive = list(frames)
+    with worker_pool(n_workers, threads_per_worker) as map_jobs:
+        for rung, epochs in enumerate(rung_budgets(min_epochs, max_epochs, eta)):
+            jobs = [job(trial, rung, epochs) for trial in alive if (trial, rung) not in results]
+            with open(os.path.join(store, "results.jsonl"), "a") as f:
+                for trial, r, res in map_jobs(_run_job, jobs):
+                    record = {'trial': trial, 'rung': r, **res}
+                    results[(trial, r)] = record
+                    f.write(json.dumps(record) + "\n")
+                    f.flush()
+
+            if epochs == max_epochs:
+                break
+            alive.sort(key=lambda trial: results[(trial, rung)]['val_mae'])
+            alive = alive[:max(1, len(alive)//eta)]
+
+    trials = []
+    for trial, frame in frames.items():
+        last = max((r for (t, _), r in results.items() if t == trial), key=lambda r: r['rung'])
+        trials.append({'trial': trial, 'cnnFrame': frame, 'epochs': last['epochs'],
+                       'val_mae': last['val_mae'], 'error': last['error']})
+    # trials that reached more epochs first, then by validation MAE
+    trials.sort(key=lambda t: (-t['epochs'], t['val_mae']))
+    return trials
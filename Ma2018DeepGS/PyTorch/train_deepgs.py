@@ -3,6 +3,9 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import TensorDataset, DataLoader
 from deepgs_model import DeepGSModel, LightGSModel, LightGS1D
+from device_loader import DeviceDataLoader
+from predict import save_model_metadata
+from profiling import NullProfiler
 import os
 
 from diagnostics import plot_actual_vs_predicted, evaluate_model, plot_both_vs_marker
@@ -10,7 +13,20 @@ import numpy as np
 from datetime import datetime
 
 import math
-from copy import deepcopy
+from copy import copy, deepcopy
+
+
+def snapshot_state(model, out=None):
+    """
+    Copy of the model's state dict as detached tensors on the same device. If out (a previous
+    snapshot) is given its tensors are overwritten in place, so no memory is allocated.
+    """
+    if out is None:
+        return {k: v.detach().clone() for k, v in model.state_dict().items()}
+    with torch.no_grad():
+        for k, v in model.state_dict().items():
+            out[k].copy_(v)
+    return out
 
 
 # trainMat, validMat (n_samples x n_markers)
@@ -21,22 +37,26 @@ def train_deepGSModel(
     device="cpu", eval_metric="mae",
     num_round=6000, batch_size=30, learning_rate=0.01,
     momentum=0.5, wd=1e-5, patience=600, verbose=True,
-    save_path="saved_models"
+    save_path="saved_models", log_every=100, checkpoint_every=None, profiler=None
 ):
+    # log_every: epochs between evaluations of the best model on the full train/valid sets
+    # checkpoint_every: epochs between writes of the best weights to disk (None: only at the end)
+    # profiler: TrainingProfiler recording per epoch timings (see profiling.py)
+    profiler = profiler or NullProfiler()
     datetime_str = datetime.now().strftime("_%Y%m%d_%H%M%S")
 
     # Create output directory if needed
     os.makedirs(save_path, exist_ok=True)
+    best_model_path = os.path.join(save_path, f"best_model{datetime_str}.pth")
+    save_model_metadata(best_model_path, cnnFrame, markerImage)
 
-    # reshape to NCHW
+    # The data sets are moved to the device once, stored as uint8/int8 and reshaped to NCHW;
+    # batches are drawn by an on-device permutation and cast to float when they are taken.
     H, W = markerImage
-    trainMat4D = trainMat.reshape(-1, 1, H, W)
-    validMat4D = validMat.reshape(-1, 1, H, W)
-
-    train_tensor = torch.tensor(trainMat4D, dtype=torch.float32)
-    valid_tensor = torch.tensor(validMat4D, dtype=torch.float32)
-    y_train = torch.tensor(trainPheno, dtype=torch.float32).view(-1, 1)
-    y_valid = torch.tensor(validPheno, dtype=torch.float32).view(-1, 1)
+    train_loader = DeviceDataLoader(trainMat, trainPheno, batch_size=batch_size, shuffle=True,
+                                    device=device, image_shape=(H, W))
+    valid_data = DeviceDataLoader(validMat, validPheno, batch_size=batch_size, shuffle=False,
+                                  device=device, image_shape=(H, W))
 
     model = DeepGSModel(cnnFrame, markerImage).to(device)
     # model = LightGSModel(markerImage).to(device)
@@ -48,73 +68,95 @@ def train_deepGSModel(
         optimizer, mode="min", factor=0.5, patience=3)
 
 
-    # Data loader
-    train_dataset = torch.utils.data.TensorDataset(train_tensor, y_train)
-    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-
     best_loss = float("inf")
     steps_no_improve = 0
 
+    # The best weights are kept in memory: preallocated tensors that are overwritten in place
+    # on every improvement, and only written to disk every checkpoint_every epochs / at the end.
+    best_state = snapshot_state(model)
+    best_model = deepcopy(model)  # only used for logging
+    best_epoch = -1
+    saved_epoch = -1
+
+    # Full train / valid sets for evaluation (the validation set is small, so it is kept as float)
+    valid_tensor_dev, y_valid_dev = valid_data.tensors()
+
     # --- Baseline MAE/MSE without any training ---
     model.eval()
     with torch.no_grad():
-        base_pred = model(train_tensor.to(device))
-        base_mae = torch.mean(torch.abs(base_pred.cpu() - y_train)).item()
+        train_tensor_dev, y_train_dev = train_loader.tensors()
+        base_pred = model(train_tensor_dev)
+        base_mae = torch.mean(torch.abs(base_pred - y_train_dev)).item()
+    del train_tensor_dev
     print(f"Baseline (untrained) Train MAE: {base_mae:.4g}")
 
     for epoch in range(num_round):
+        profiler.epoch_start(epoch)
         model.train()
-        for Xb, yb in train_loader:
-            Xb, yb = Xb.to(device), yb.to(device)
-
-            pred = model(Xb)
-            loss = criterion(pred, yb)
+        for Xb, yb in profiler.iterate(train_loader):
+            with profiler.phase("forward"):
+                pred = model(Xb)
+                loss = criterion(pred, yb)
 
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            with profiler.phase("backward"):
+                optimizer.zero_grad()
+                loss.backward()
+            with profiler.phase("optimizer"):
+                optimizer.step()
+            profiler.add_samples(len(Xb))
 
         # Validation
         model.eval()
-        with torch.no_grad():
-            pred_valid = model(valid_tensor.to(device))
-            val_loss = criterion(pred_valid, y_valid.to(device)).item()
+        with profiler.phase("eval"), torch.no_grad():
+            pred_valid = model(valid_tensor_dev)
+            val_loss = criterion(pred_valid, y_valid_dev).item()
+        profiler.epoch_end(val_loss=val_loss)
 
-        if verbose and epoch % 100 == 0:
+        log_epoch = verbose and epoch % log_every == 0
+        if log_epoch:
             print(f"Epoch {epoch}, val {eval_metric}: {val_loss:.4f}")
 
         # Early stopping
         if val_loss < best_loss:
             best_loss = val_loss
-            best_model = model
-            os.makedirs(save_path, exist_ok=True)
-            best_model_path = os.path.join(save_path, f"best_model{datetime_str}.pth")
-            torch.save(model.state_dict(), best_model_path)
+            snapshot_state(model, best_state)
+            best_epoch = epoch
             steps_no_improve = 0
         else:
             steps_no_improve += 1
 
+        if checkpoint_every is not None and (epoch + 1) % checkpoint_every == 0 and best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
+            saved_epoch = best_epoch
+
         if steps_no_improve > patience:
             if verbose:
                 print("Early stopping triggered.")
             break
 
-        best_model.eval()
-        with torch.no_grad():
-            pred_train = best_model(train_tensor.to(device))
-            train_loss = criterion(pred_train, y_train.to(device)).item()
-            pred_valid = best_model(valid_tensor.to(device))
-            val_loss = criterion(pred_valid, y_valid.to(device)).item()
-        if verbose and epoch % 100 == 0:
-            print(f"Epoch {epoch}, best val loss {eval_metric}: {best_loss:.4f}, train loss {eval_metric}: {train_loss:.4f}, val loss {eval_metric}: {val_loss:.4f}")
-            print(torch.mean(torch.abs(pred_train-y_train.to(device))))
+        if log_epoch:
+            best_model.load_state_dict(best_state)
+            best_model.eval()
+            with torch.no_grad():
+                train_tensor_dev, y_train_dev = train_loader.tensors()
+                pred_train = best_model(train_tensor_dev)
+                train_loss = criterion(pred_train, y_train_dev).item()
+                pred_valid = best_model(valid_tensor_dev)
+                best_val_loss = criterion(pred_valid, y_valid_dev).item()
+            print(f"Epoch {epoch}, best val loss {eval_metric}: {best_loss:.4f}, train loss {eval_metric}: {train_loss:.4f}, val loss {eval_metric}: {best_val_loss:.4f}")
+            print(torch.mean(torch.abs(pred_train-y_train_dev)))
+            del train_tensor_dev
+
+    profiler.close()
 
     # ----- Diagnostics after training -----
 
     # Load best model before returning
-    if os.path.exists(best_model_path):
-        model.load_state_dict(torch.load(best_model_path, map_location=device))
-        print("Loaded best model.")
+    if best_epoch >= 0:
+        model.load_state_dict(best_state)
+        if best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
+        print(f"Loaded best model (epoch {best_epoch}).")
     else:
         print("Can't load best model.")
 
@@ -170,8 +212,10 @@ def train_deepGSModel2(
     device="cpu", eval_metric="mae",
     num_round=6000, batch_size=30, learning_rate=0.01,
     momentum=0.5, wd=1e-5, patience=600, verbose=True,
-    save_path="saved_models"
+    save_path="saved_models", checkpoint_every=None, profiler=None
 ):
+    # checkpoint_every: epochs between writes of the best weights to disk (None: only at the end)
+    profiler = profiler or NullProfiler()  # TrainingProfiler recording per epoch timings
     datetime_str = datetime.now().strftime("_%Y%m%d_%H%M%S")
 
     # Create output directory if needed
@@ -186,36 +230,15 @@ def train_deepGSModel2(
     assert trainMat.shape[1] == H * W, "Marker count must match H*W"
 
     # -------------------------------------------------------------
-    # 3. Reshape into NCHW tensors (CPU) for DeepGS-style CNN
+    # 3. Move the data to the device once (uint8/int8, NCHW); batches
+    #    are drawn by an on-device permutation and cast to float
     # -------------------------------------------------------------
-    trainMat4D = trainMat.reshape(-1, 1, H, W)
-    validMat4D = validMat.reshape(-1, 1, H, W)
-
-    # -------------------------------------------------------------
-    # 4. Convert to torch tensors on CPU (MPS-friendly)
-    # -------------------------------------------------------------
-    # Use from_numpy to avoid copies when you already have NumPy arrays
-    train_tensor = torch.from_numpy(trainMat4D).float()       # CPU
-    valid_tensor = torch.from_numpy(validMat4D).float()       # CPU
-    y_train = torch.from_numpy(trainPheno).float().view(-1, 1)   # CPU
-    y_valid = torch.from_numpy(validPheno).float().view(-1, 1)   # CPU
-
-    # --- 2) DataLoaders (train shuffled, valid not) ---
-    train_loader = DataLoader(
-        TensorDataset(train_tensor, y_train),
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=0,        # you can increase if CPU allows
-        pin_memory=False       # if device is CUDA
-    )
-
-    valid_loader = DataLoader(
-        TensorDataset(valid_tensor, y_valid),
-        batch_size=batch_size,  # keep the same if you use BatchNorm
-        shuffle=False,
-        num_workers=0,
-        pin_memory=False
-    )
+    train_loader = DeviceDataLoader(trainMat, trainPheno, batch_size=batch_size, shuffle=True,
+                                    device=device, image_shape=(H, W))
+    valid_loader = DeviceDataLoader(validMat, validPheno, batch_size=batch_size, shuffle=False,
+                                    device=device, image_shape=(H, W))
+    train_tensor, y_train = train_loader.tensors()
+    valid_tensor, y_valid = valid_loader.tensors()
 
     # --- 3) Model / Optimiser / Loss ---
     model = DeepGSModel(cnnFrame, markerImage).to(device)
@@ -226,11 +249,16 @@ def train_deepGSModel2(
     criterion = nn.L1Loss() if eval_metric == "mae" else nn.MSELoss()
 
     best_loss = float("inf")
-    best_state = None
     steps_no_improve = 0
 
+    # Best weights kept in memory as in train_deepGSModel (overwritten in place)
+    best_state = snapshot_state(model)
+    best_epoch = -1
+    saved_epoch = -1
+
     os.makedirs(save_path, exist_ok=True)
     best_model_path = os.path.join(save_path, f"best_model{datetime_str}.pth")
+    save_model_metadata(best_model_path, cnnFrame, markerImage)
 
     # --- Sanity checks on data ---
     def stats(name, t):
@@ -248,30 +276,33 @@ def train_deepGSModel2(
     # --- Baseline MAE/MSE without any training ---
     model.eval()
     with torch.no_grad():
-        base_pred = model(train_tensor.to(device))
-        base_mae = torch.mean(torch.abs(base_pred.cpu() - y_train)).item()
+        base_pred = model(train_tensor)
+        base_mae = torch.mean(torch.abs(base_pred - y_train)).item()
     print(f"Baseline (untrained) Train MAE: {base_mae:.4g}")
+    del train_tensor, valid_tensor  # float copies only needed for the checks above
 
     for epoch in range(num_round):
+        profiler.epoch_start(epoch)
         # ----- Train -----
         model.train()
         running_train_loss = 0.0
         n_train = 0
 
-        for xb, yb in train_loader:
-            xb = xb.to(device)
-            yb = yb.to(device)
-
-            optimizer.zero_grad()
-            pred = model(xb)
-            loss = criterion(pred, yb)
-            loss.backward()
-            optimizer.step()
+        for xb, yb in profiler.iterate(train_loader):
+            with profiler.phase("forward"):
+                optimizer.zero_grad()
+                pred = model(xb)
+                loss = criterion(pred, yb)
+            with profiler.phase("backward"):
+                loss.backward()
+            with profiler.phase("optimizer"):
+                optimizer.step()
 
             # track epoch average correctly
             bs = xb.size(0)
             running_train_loss += loss.item() * bs
             n_train += bs
+            profiler.add_samples(bs)
 
         train_loss_epoch = running_train_loss / max(1, n_train)
 
@@ -280,10 +311,8 @@ def train_deepGSModel2(
         running_val_loss = 0.0
         n_val = 0
 
-        with torch.no_grad():
+        with profiler.phase("eval"), torch.no_grad():
             for xb, yb in valid_loader:
-                xb = xb.to(device)
-                yb = yb.to(device)
                 pv = model(xb)
                 l = criterion(pv, yb)
                 bs = xb.size(0)
@@ -291,6 +320,7 @@ def train_deepGSModel2(
                 n_val += bs
 
         val_loss = running_val_loss / max(1, n_val)
+        profiler.epoch_end(train_loss=train_loss_epoch, val_loss=val_loss)
 
         # Optional: log RMSE even when criterion is MSELoss
         if eval_metric.lower() in {"rmse", "mse"} and isinstance(criterion, nn.MSELoss):
@@ -308,22 +338,28 @@ def train_deepGSModel2(
         # ----- Early stopping on VAL loss -----
         if val_loss < best_loss - 1e-12:   # small tolerance to avoid oscillation
             best_loss = val_loss
-            best_state = deepcopy(model.state_dict())
-            torch.save(best_state, best_model_path)
+            snapshot_state(model, best_state)
+            best_epoch = epoch
             steps_no_improve = 0
         else:
             steps_no_improve += 1
 
+        if checkpoint_every is not None and (epoch + 1) % checkpoint_every == 0 and best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
+            saved_epoch = best_epoch
+
         if steps_no_improve >= patience:
             if verbose:
                 print(f"Early stopping (no improvement for {patience} epochs).")
             break
 
+    profiler.close()
+
     # --- 4) Load the true best weights before returning/using ---
-    if best_state is None and os.path.isfile(best_model_path):
-        best_state = torch.load(best_model_path, map_location=device)
-    if best_state is not None:
+    if best_epoch >= 0:
         model.load_state_dict(best_state)
+        if best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
     model.eval()
 
     import matplotlib.pyplot as plt
@@ -361,11 +397,8 @@ def train_deepGSModel2(
     # ---- After training is done and best weights loaded ----
 
     # Build DataLoaders for plotting (validation loader already exists)
-    train_plot_loader = DataLoader(
-        TensorDataset(train_tensor, y_train),
-        batch_size=batch_size,
-        shuffle=False
-    )
+    train_plot_loader = copy(train_loader)  # shares the device tensors
+    train_plot_loader.shuffle = False
 
     # Training scatter
     plot_predictions(model, train_plot_loader, device,
@@ -395,9 +428,9 @@ def train_deepGSModel2(
     # else:
     #     print("Can't load best model.")
 
-    for parameter in model.parameters():
-        print(parameter.data.shape)
-        print(parameter.data)
+    if verbose:
+        for parameter in model.parameters():
+            print(parameter.data.shape)
 
     model.eval()
     # Train predictions
@@ -480,7 +513,9 @@ def train_model(
     criterion=None,
     save_path="checkpoints",
     verbose=True,
-    grad_clip=5.0
+    grad_clip=5.0,
+    checkpoint_every=None,
+    profiler=None
 ):
     """
     A unified train() function that works for ANY of your models:
@@ -491,10 +526,15 @@ def train_model(
 
     Requirements:
         model: nn.Module
-        train_loader, valid_loader: DataLoader objects
+        train_loader, valid_loader: DataLoader or DeviceDataLoader objects (the latter
+            yields batches that are already on the device, so no copies are made)
         device: torch.device('cuda'), 'mps', or 'cpu'
+        checkpoint_every: epochs between writes of the best weights to
+            save_path/best_model.pth (None: the best weights are only kept in memory)
+        profiler: optional TrainingProfiler recording per epoch timings (see profiling.py)
 
     """
+    profiler = profiler or NullProfiler()
 
     os.makedirs(save_path, exist_ok=True)
 
@@ -510,33 +550,44 @@ def train_model(
         )
 
     best_loss = float("inf")
-    best_state = None
     no_improve = 0
 
+    # Best weights kept in memory as in train_deepGSModel (overwritten in place)
+    best_state = snapshot_state(model)
+    best_epoch = -1
+    saved_epoch = -1
+    best_model_path = os.path.join(save_path, "best_model.pth")
+
     for epoch in range(num_epochs):
+        profiler.epoch_start(epoch)
         # ---- TRAINING ----
         model.train()
         train_loss_sum = 0.0
         n_train = 0
 
-        for xb, yb in train_loader:
-            xb = to_device_safe(xb, device)
-            yb = to_device_safe(yb, device)
+        for xb, yb in profiler.iterate(train_loader):
+            with profiler.phase("data"):
+                xb = to_device_safe(xb, device)
+                yb = to_device_safe(yb, device)
 
-            pred = model(xb)
-            loss = criterion(pred, yb)
+            with profiler.phase("forward"):
+                pred = model(xb)
+                loss = criterion(pred, yb)
 
-            optimizer.zero_grad(set_to_none=True)
-            loss.backward()
+            with profiler.phase("backward"):
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
 
-            # Gradient clipping for stability
-            torch.nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
+            with profiler.phase("optimizer"):
+                # Gradient clipping for stability
+                torch.nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
 
-            optimizer.step()
+                optimizer.step()
 
             bs = xb.size(0)
             train_loss_sum += loss.item() * bs
             n_train += bs
+            profiler.add_samples(bs)
 
         train_loss = train_loss_sum / max(1, n_train)
 
@@ -545,7 +596,7 @@ def train_model(
         val_loss_sum = 0.0
         n_valid = 0
 
-        with torch.no_grad():
+        with profiler.phase("eval"), torch.no_grad():
             for xb, yb in valid_loader:
                 xb = to_device_safe(xb, device)
                 yb = to_device_safe(yb, device)
@@ -558,6 +609,7 @@ def train_model(
                 n_valid += bs
 
         val_loss = val_loss_sum / max(1, n_valid)
+        profiler.epoch_end(train_loss=train_loss, val_loss=val_loss)
 
         # Scheduler step
         if scheduler is not None:
@@ -581,18 +633,27 @@ def train_model(
         # Early stopping
         if val_loss < best_loss - 1e-12:
             best_loss = val_loss
-            best_state = deepcopy(model.state_dict())
+            snapshot_state(model, best_state)
+            best_epoch = epoch
             no_improve = 0
         else:
             no_improve += 1
 
+        if checkpoint_every is not None and (epoch + 1) % checkpoint_every == 0 and best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
+            saved_epoch = best_epoch
+
         if no_improve >= patience:
             if verbose:
                 print(f"Early stopping at epoch {epoch}.")
             break
 
+    profiler.close()
+
     # ---- Restore best weights ----
-    if best_state is not None:
+    if best_epoch >= 0:
         model.load_state_dict(best_state)
+        if checkpoint_every is not None and best_epoch > saved_epoch:
+            torch.save(best_state, best_model_path)
 
     return model, best_loss
\ No newline at end of file